@@ -0,0 +1,301 @@
+"""Read-only, memory-mapped GradeBook archives, for keeping many terms of
+grades around without loading them.
+
+An archive file is:
+  MAGIC and the length of a JSON header (assignments, outofs, field
+    widths, offsets);
+  one fixed-width row per student with all Student attributes and the
+    comment, NUL-padded;
+  one block of num_rows little-endian doubles per assignment (NaN where
+    missing), so that a whole column is a single memoryview;
+  for each of INDEXED_BY, an index of (fixed-width key, row) entries
+    sorted by key, searched by bisection.
+
+Write an archive with write_archive and read it with MappedGradeBook.
+Nothing is deserialized until it is asked for, and processes that map
+the same archive share its pages.
+
+"""
+
+from array import array
+import json
+import math
+import mmap
+import struct
+import sys
+
+from .gradebook import GradeBook, Grades
+from .students import Student, STUDENT_ATTRS
+
+MAGIC = b'UTGBARC1'
+
+# attributes with an on-disk index
+INDEXED_BY = ('student_number', 'utorid')
+
+_PREFIX = struct.Struct('<8sQ')
+_ROW_NUMBER = struct.Struct('<I')
+_ROW_FIELDS = STUDENT_ATTRS + ('comment',)
+
+
+def write_archive(gradebook, path):
+    """Write gradebook to an archive file path."""
+
+    records = list(gradebook.studentgrades.items())
+    assts = list(gradebook.outofs)
+    num_rows = len(records)
+
+    encoded = []
+    for key, (student, _) in records:
+        values = [getattr(student, attr) for attr in STUDENT_ATTRS]
+        values.append(gradebook.comments.get(key))
+        encoded.append([(value or '').encode('utf-8') for value in values])
+    widths = [max((len(row[i]) for row in encoded), default=0)
+              for i in range(len(_ROW_FIELDS))]
+    row_size = sum(widths)
+
+    rows = b''.join(
+        b''.join(value.ljust(width, b'\0')
+                 for value, width in zip(row, widths))
+        for row in encoded)
+
+    columns = []
+    for asst in assts:
+        column = array('d')
+        for _, (_, grades) in records:
+            try:
+                column.append(grades.get_grade(asst))
+            except (KeyError, AttributeError):  # no grade, or no Grades
+                column.append(math.nan)
+        if sys.byteorder != 'little':
+            column.byteswap()
+        columns.append(column.tobytes())
+
+    indexes = []
+    for attr in INDEXED_BY:
+        i = _ROW_FIELDS.index(attr)
+        entries = sorted((row[i].ljust(widths[i], b'\0'), number)
+                         for number, row in enumerate(encoded) if row[i])
+        indexes.append(b''.join(key + _ROW_NUMBER.pack(number)
+                                for key, number in entries))
+
+    header = {'assts': assts,
+              'outofs': [gradebook.outofs[asst] for asst in assts],
+              'formulas': gradebook.formulas,
+              'dict_key': gradebook.dict_key,
+              'fields': list(_ROW_FIELDS),
+              'widths': widths,
+              'num_rows': num_rows,
+              'byteorder': 'little'}
+    # everything after the header starts at a multiple of 8
+    header_bytes = json.dumps(header).encode('utf-8')
+    rows_offset = _round_up(_PREFIX.size + len(header_bytes) + 1024)
+    offset = _round_up(rows_offset + len(rows))
+    header['rows_offset'] = rows_offset
+    header['columns_offset'] = offset
+    offset += sum(len(column) for column in columns)
+    header['indexes'] = {}
+    for attr, index in zip(INDEXED_BY, indexes):
+        header['indexes'][attr] = [offset, len(index)]
+        offset += len(index)
+    header_bytes = json.dumps(header).encode('utf-8')
+    if _PREFIX.size + len(header_bytes) > rows_offset:
+        raise ValueError('Archive header too large.')
+
+    with open(path, 'wb') as outfile:
+        outfile.write(_PREFIX.pack(MAGIC, len(header_bytes)))
+        outfile.write(header_bytes.ljust(rows_offset - _PREFIX.size, b'\0'))
+        outfile.write(rows.ljust(header['columns_offset'] - rows_offset,
+                                 b'\0'))
+        for column in columns:
+            outfile.write(column)
+        for index in indexes:
+            outfile.write(index)
+
+
+class MappedGradeBook:
+    """A read-only GradeBook backed by a memory-mapped archive file.
+    Supports the lookups of GradeBook; use to_gradebook for anything
+    else.
+
+    """
+
+    def __init__(self, path):
+        """Map the archive file path. Raise ValueError if it is not an
+        archive.
+
+        """
+
+        with open(path, 'rb') as infile:
+            self._map = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, header_length = _PREFIX.unpack_from(self._map)
+        if magic != MAGIC:
+            self._map.close()
+            raise ValueError('Not a GradeBook archive: {}'.format(path))
+        header = json.loads(bytes(
+            self._map[_PREFIX.size:_PREFIX.size + header_length]))
+
+        self.path = path
+        self.assts = header['assts']
+        self.outofs = dict(zip(self.assts, header['outofs']))
+        self.formulas = header['formulas']
+        self.dict_key = header['dict_key']
+        self._num_rows = header['num_rows']
+        # archives from before byteorder was recorded are in native order
+        self._byteorder = header.get('byteorder', sys.byteorder)
+        self._double = struct.Struct(
+            '<d' if self._byteorder == 'little' else '>d')
+        self._widths = header['widths']
+        self._row_size = sum(self._widths)
+        self._rows_offset = header['rows_offset']
+        self._asst_offsets = {
+            asst: header['columns_offset'] + 8 * self._num_rows * i
+            for i, asst in enumerate(self.assts)}
+        self._indexes = {attr: tuple(bounds)
+                         for attr, bounds in header['indexes'].items()}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Unmap the archive."""
+
+        self._map.close()
+
+    def __len__(self):
+        return self._num_rows
+
+    def find_row(self, attribute, attr_value):
+        """Return the row number of the Student whose attribute is
+        attr_value, or None if there is no such Student. attribute must
+        be one of INDEXED_BY.
+
+        """
+
+        offset, length = self._indexes[attribute]
+        width = self._widths[_ROW_FIELDS.index(attribute)]
+        key = attr_value.encode('utf-8')
+        if len(key) > width:
+            return None
+        key = key.ljust(width, b'\0')
+        entry_size = width + _ROW_NUMBER.size
+        low, high = 0, length // entry_size
+        while low < high:
+            middle = (low + high) // 2
+            start = offset + middle * entry_size
+            if self._map[start:start + width] < key:
+                low = middle + 1
+            else:
+                high = middle
+        start = offset + low * entry_size
+        if low * entry_size < length and self._map[start:start + width] == key:
+            return _ROW_NUMBER.unpack_from(self._map, start + width)[0]
+        return None
+
+    def get_student(self, row):
+        """Return the Student in row."""
+
+        return Student._make_unchecked(self._row_values(row)[:-1])
+
+    def get_comment(self, row):
+        """Return the comment for the Student in row, or None."""
+
+        return self._row_values(row)[-1]
+
+    def get_grades(self, row):
+        """Return the Grades of the Student in row."""
+
+        grades = Grades()
+        for asst, offset in self._asst_offsets.items():
+            (grade,) = self._double.unpack_from(self._map, offset + 8 * row)
+            if not math.isnan(grade):
+                grades.grades[asst] = grade
+        return grades
+
+    def get_student_info(self, search_by):
+        """search_by is a Dict[attribute, attr_value], with attributes in
+        INDEXED_BY. Return (Student, Grades) if a Student matches any of
+        the search_by, or None if no such Student."""
+
+        for attribute, attr_value in search_by.items():
+            row = self.find_row(attribute, attr_value)
+            if row is not None:
+                return (self.get_student(row), self.get_grades(row))
+        return None
+
+    def get_student_grades_by_utorid(self, utorid):
+        """Return Grades of a Student with utorid."""
+
+        return self.get_student_grades_by_attribute('utorid', utorid)
+
+    def get_student_grades_by_student_number(self, student_number):
+        """Return Grades of a Student with student_number."""
+
+        return self.get_student_grades_by_attribute('student_number',
+                                                    student_number)
+
+    def get_student_grades_by_attribute(self, attribute, attr_value):
+        """Return Grades of a Student with value of attribute (one of
+        INDEXED_BY) equal to attr_value. Raise Exception if no such
+        Student.
+
+        """
+
+        row = self.find_row(attribute, attr_value)
+        if row is None:
+            raise Exception('No student with {} value {}.'.format(
+                attribute, attr_value))
+        return self.get_grades(row)
+
+    def column_view(self, asst):
+        """Return a read-only memoryview of doubles: the grades of all
+        students for asst, by row, with NaN where missing. No copy is
+        made, unless the archive was written in the other byte order.
+        Release it before closing this MappedGradeBook.
+
+        """
+
+        offset = self._asst_offsets[asst]
+        view = memoryview(self._map)[offset:offset + 8 * self._num_rows]
+        if self._byteorder == sys.byteorder:
+            return view.cast('d')
+        column = array('d')
+        column.frombytes(view)
+        view.release()
+        column.byteswap()
+        return memoryview(column).toreadonly()
+
+    def get_column(self, asst):
+        """Return a List of all recorded grades for assignment asst."""
+
+        with self.column_view(asst) as column:
+            return [grade for grade in column if not math.isnan(grade)]
+
+    def to_gradebook(self):
+        """Return a regular (in-memory) GradeBook with the contents of this
+        archive.
+
+        """
+
+        gradebook = GradeBook(None, self.dict_key, self.outofs,
+                              formulas=self.formulas, sanity_check=False)
+        for row in range(self._num_rows):
+            gradebook.add_student_grades(self.get_student(row),
+                                         self.get_grades(row),
+                                         self.get_comment(row))
+        return gradebook
+
+    def _row_values(self, row):
+        values = []
+        start = self._rows_offset + row * self._row_size
+        for width in self._widths:
+            value = self._map[start:start + width].rstrip(b'\0')
+            values.append(value.decode('utf-8') if value else None)
+            start += width
+        return values
+
+
+def _round_up(offset):
+    return (offset + 7) // 8 * 8
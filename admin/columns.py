@@ -0,0 +1,134 @@
+"""Columnar storage of grades: one dense array of floats per assignment."""
+
+from array import array
+from itertools import compress
+
+
+class GradeMatrix:
+    """A dense matrix of grades, stored by column. Rows are students,
+    columns are assignments. Each column is an array('d') together
+    with a bytearray mask that has a 1 where a grade is present and a
+    0 where it is missing.
+
+    Rows are never reused: a dropped row simply has no grades present.
+
+    """
+
+    def __init__(self, assts=None):
+        """Initialize an empty GradeMatrix with columns for assts."""
+
+        self.assts = []
+        self.columns = []
+        self.present = []
+        self.num_rows = 0
+        self._asst_index = {}
+        for asst in assts or []:
+            self.add_column(asst)
+
+    def __len__(self):
+        return self.num_rows
+
+    def add_column(self, asst):
+        """Add an (all missing) column for asst, unless there is one
+        already. Return the index of the column.
+
+        """
+
+        if asst in self._asst_index:
+            return self._asst_index[asst]
+        self._asst_index[asst] = len(self.assts)
+        self.assts.append(asst)
+        self.columns.append(array('d', bytes(8 * self.num_rows)))
+        self.present.append(bytearray(self.num_rows))
+        return self._asst_index[asst]
+
+    def add_row(self):
+        """Add an (all missing) row. Return the index of the new row."""
+
+        for column, present in zip(self.columns, self.present):
+            column.append(0.0)
+            present.append(0)
+        self.num_rows += 1
+        return self.num_rows - 1
+
+    def add_rows(self, count):
+        """Add count (all missing) rows. Return a range of their indices."""
+
+        for column, present in zip(self.columns, self.present):
+            column.extend(array('d', bytes(8 * count)))
+            present.extend(bytes(count))
+        self.num_rows += count
+        return range(self.num_rows - count, self.num_rows)
+
+    def drop_row(self, row):
+        """Mark all grades in row as missing."""
+
+        for present in self.present:
+            present[row] = 0
+
+    def get(self, row, asst):
+        """Return the grade in row for asst. Raise KeyError if there is no
+        such grade.
+
+        """
+
+        col = self._asst_index.get(asst)
+        if col is None or not self.present[col][row]:
+            raise KeyError('No such assignment: {}'.format(asst))
+        return self.columns[col][row]
+
+    def set(self, row, asst, grade):
+        """Set the grade in row for asst. grade must be a float."""
+
+        col = self.add_column(asst)
+        self.columns[col][row] = grade
+        self.present[col][row] = 1
+
+    def discard(self, row, asst):
+        """Mark the grade in row for asst as missing, if there is one."""
+
+        col = self._asst_index.get(asst)
+        if col is not None:
+            self.present[col][row] = 0
+
+    def set_column(self, asst, grades, present=None):
+        """Replace the column for asst with grades, a Sequence of floats with
+        one per row. present is a mask like those in self.present; if
+        None, all grades are present.
+
+        """
+
+        col = self.add_column(asst)
+        self.columns[col] = array('d', grades)
+        self.present[col] = (bytearray(b'\x01') * self.num_rows
+                             if present is None else bytearray(present))
+
+    def row_assts(self, row):
+        """Return a List of assignments with a grade present in row."""
+
+        return [asst for asst, present in zip(self.assts, self.present)
+                if present[row]]
+
+    def row_dict(self, row):
+        """Return a Dict[asst, grade] of all grades present in row."""
+
+        return {asst: column[row] for asst, column, present
+                in zip(self.assts, self.columns, self.present)
+                if present[row]}
+
+    def values(self, asst):
+        """Return a List of all grades present for asst, in row order."""
+
+        col = self._asst_index.get(asst)
+        if col is None:
+            return []
+        return list(compress(self.columns[col], self.present[col]))
+
+    def column(self, asst):
+        """Return (grades: array('d'), present: bytearray) for asst. Raise
+        KeyError if there is no such column.
+
+        """
+
+        col = self._asst_index[asst]
+        return self.columns[col], self.present[col]
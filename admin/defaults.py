@@ -11,6 +11,12 @@ DEFAULT_STUDENT_STR = ('last', 'first', 'student_number', 'utorid',
 
 DEFAULT_CATME_STR = ('first', 'last', 'email', 'utorid', 'team')
 
+# writers join this many lines into a single write
+WRITE_BLOCK_LINES = 1000
+
+# buffer size for files opened by writers given a path
+WRITE_BUFFER_SIZE = 1 << 20
+
 
 def default_student_sort(student):
     '''Sort Student's by last name, then first name.'''
@@ -18,5 +24,9 @@ def default_student_sort(student):
     return student.last + student.first
 
 
-# TODO Fix this
+# outof for an assignment added without one
+DEFAULT_OUTOF = 100
+
+# outof for a calculated gf column whose formula cannot be evaluated on
+# the outofs of the columns it depends on
 DEFAULT_FORMULA_OUTOF = 100
@@ -0,0 +1,155 @@
+"""Structural differences between two GradeBooks, and between two
+rosters (Students)."""
+
+from .gradebook import SEARCH_BY, grades_equal
+from .students import SECTION_ATTRS
+
+
+class GradeBookDiff:
+    """Differences between an old and a new GradeBook.
+
+    added, removed: List[Student] only in the new, only in the old.
+    changed_grades: List[(Student, asst, old_grade, new_grade)], where a
+      grade is None if it is missing.
+    changed_outofs: Dict[asst, (old_outof, new_outof)], where an outof
+      is None if the assignment is missing.
+    changed_comments: List[(Student, old_comment, new_comment)], where a
+      comment is None if there is none.
+    """
+
+    def __init__(self):
+        self.added = []
+        self.removed = []
+        self.changed_grades = []
+        self.changed_outofs = {}
+        self.changed_comments = []
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed_grades or
+                    self.changed_outofs or self.changed_comments)
+
+    def __str__(self):
+        lines = []
+        lines.extend('+ {}'.format(student) for student in self.added)
+        lines.extend('- {}'.format(student) for student in self.removed)
+        lines.extend('outof {}: {} -> {}'.format(asst, old, new)
+                     for asst, (old, new) in self.changed_outofs.items())
+        lines.extend('{} {}: {} -> {}'.format(student, asst, old, new)
+                     for student, asst, old, new in self.changed_grades)
+        lines.extend('{} comment: {} -> {}'.format(student, old, new)
+                     for student, old, new in self.changed_comments)
+        return '\n'.join(lines)
+
+
+def diff_gradebooks(old, new):
+    """Return a GradeBookDiff of GradeBooks old and new. Students are
+    matched on any of SEARCH_BY, and grades are compared with
+    grades_equal.
+
+    """
+
+    diff = GradeBookDiff()
+
+    for asst in old.outofs.keys() | new.outofs.keys():
+        old_outof, new_outof = old.outofs.get(asst), new.outofs.get(asst)
+        if old_outof is None or new_outof is None or not grades_equal(
+                old_outof, new_outof):
+            diff.changed_outofs[asst] = (old_outof, new_outof)
+
+    matched = set()  # id()s of new Students matched to an old one
+    for old_key, (student, old_grades) in old.studentgrades.items():
+        new_record = new.get_student_info(
+            {attr: getattr(student, attr) for attr in SEARCH_BY
+             if getattr(student, attr) is not None})
+        if new_record is None:
+            diff.removed.append(student)
+            continue
+        new_student, new_grades = new_record
+        matched.add(id(new_student))
+
+        _diff_grades(diff, new_student, old_grades, new_grades)
+
+        old_comment = old.comments.get(old_key) or None
+        new_comment = new.comments.get(
+            getattr(new_student, new.dict_key)) or None
+        if old_comment != new_comment:
+            diff.changed_comments.append(
+                (new_student, old_comment, new_comment))
+
+    diff.added = [student for student, _ in new.studentgrades.values()
+                  if id(student) not in matched]
+    return diff
+
+
+def _diff_grades(diff, student, old_grades, new_grades):
+    old_grades = old_grades.grades if old_grades is not None else {}
+    new_grades = new_grades.grades if new_grades is not None else {}
+    if old_grades == new_grades:  # the common case: nothing to round
+        return
+    for asst, old_grade in old_grades.items():
+        new_grade = new_grades.get(asst)
+        if new_grade is None or not grades_equal(old_grade, new_grade):
+            diff.changed_grades.append((student, asst, old_grade, new_grade))
+    for asst, new_grade in new_grades.items():
+        if asst not in old_grades:
+            diff.changed_grades.append((student, asst, None, new_grade))
+
+
+class RosterDiff:
+    """Differences between an old and a new roster (Students).
+
+    added, dropped: List[Student] only in the new, only in the old.
+    moved: List[(Student, attribute, old_section, new_section)] for
+      Students whose attribute (one of SECTION_ATTRS) changed.
+    changed_emails: List[(Student, old_email, new_email)].
+    Students in moved and changed_emails are from the new roster.
+    """
+
+    def __init__(self):
+        self.added = []
+        self.dropped = []
+        self.moved = []
+        self.changed_emails = []
+
+    def __bool__(self):
+        return bool(self.added or self.dropped or self.moved or
+                    self.changed_emails)
+
+    def __str__(self):
+        lines = []
+        lines.extend('+ {}'.format(student) for student in self.added)
+        lines.extend('- {}'.format(student) for student in self.dropped)
+        lines.extend('{} {}: {} -> {}'.format(student, attr, old, new)
+                     for student, attr, old, new in self.moved)
+        lines.extend('{} email: {} -> {}'.format(student, old, new)
+                     for student, old, new in self.changed_emails)
+        return '\n'.join(lines)
+
+
+def diff_students(old, new):
+    """Return a RosterDiff of Students old and new (e.g., two daily
+    classlists). Students are matched on any of EQ_STUDENTS.
+
+    """
+
+    diff = RosterDiff()
+    matched = set()  # id()s of new Students matched to an old one
+    for old_student in old:
+        new_student = new.match(old_student)
+        if new_student is None:
+            diff.dropped.append(old_student)
+            continue
+        matched.add(id(new_student))
+
+        for attr in SECTION_ATTRS:
+            old_section = getattr(old_student, attr)
+            new_section = getattr(new_student, attr)
+            if old_section != new_section:
+                diff.moved.append((new_student, attr, old_section,
+                                   new_section))
+        if old_student.email != new_student.email:
+            diff.changed_emails.append(
+                (new_student, old_student.email, new_student.email))
+
+    diff.added = [student for student in new if id(student) not in matched]
+    return diff
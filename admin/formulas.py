@@ -0,0 +1,327 @@
+"""Calculated gf columns: formulas like
+
+    total = 0.4 * exam + 0.6 * (a1 + a2) / 2
+
+parsed into a dependency graph and compiled to Python functions that
+are applied to whole columns of grades at once.
+
+"""
+
+import ast
+
+# functions that may be called in a formula
+FUNCTIONS = {'min': min, 'max': max, 'abs': abs, 'round': round}
+
+_ALLOWED_NODES = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.Call,
+                  ast.Name, ast.Load, ast.Constant,
+                  ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow, ast.Mod,
+                  ast.UAdd, ast.USub)
+
+
+class Formula:
+    """One calculated column: name = expression."""
+
+    def __init__(self, name, expression):
+        """Parse and compile expression. Raise FormulaError if it is not a
+        valid formula.
+
+        """
+
+        self.name = name
+        self.expression = expression.strip()
+        try:
+            tree = ast.parse(self.expression, mode='eval')
+        except SyntaxError as error:
+            raise FormulaError(name, expression, error.msg) from error
+
+        dependencies = []
+        for node in ast.walk(tree):
+            if not isinstance(node, _ALLOWED_NODES):
+                raise FormulaError(name, expression,
+                                   'unsupported {}'.format(
+                                       type(node).__name__))
+            if isinstance(node, ast.Call) and not (
+                    isinstance(node.func, ast.Name) and
+                    node.func.id in FUNCTIONS and not node.keywords):
+                raise FormulaError(name, expression, 'unsupported call')
+            if isinstance(node, ast.Constant) and (
+                    type(node.value) not in (int, float)):
+                raise FormulaError(name, expression, 'unsupported constant')
+            if (isinstance(node, ast.Name) and node.id not in FUNCTIONS and
+                    node.id not in dependencies):
+                dependencies.append(node.id)
+        self.dependencies = tuple(dependencies)
+        tree = _FloatPower().visit(tree)
+
+        # compile to a function of the dependencies, in order
+        lambda_tree = ast.Expression(ast.Lambda(
+            ast.arguments(posonlyargs=[],
+                          args=[ast.arg(dep) for dep in dependencies],
+                          kwonlyargs=[], kw_defaults=[], defaults=[]),
+            tree.body))
+        self.function = eval(  # pylint: disable=eval-used
+            compile(ast.fix_missing_locations(lambda_tree),
+                    '<formula {}>'.format(name), 'eval'),
+            {'__builtins__': {}, '_power': _power, **FUNCTIONS})
+
+    def __str__(self):
+        return '{} = {}'.format(self.name, self.expression)
+
+    def evaluate(self, values):
+        """Return the value of this formula given values, a Dict[name,
+        float] with a value for every dependency.
+
+        """
+
+        return float(self.function(*(values[dep]
+                                     for dep in self.dependencies)))
+
+    def evaluate_columns(self, columns, num_rows):
+        """Return a List of num_rows values of this formula, one per row,
+        given columns, a Dict[name, Sequence[float]] of num_rows-long
+        columns with one for every dependency. A row on which the
+        formula cannot be evaluated (e.g., it divides by 0, or a value
+        is None) gets None.
+
+        """
+
+        args = [columns[dep] for dep in self.dependencies]
+        if not args:
+            return [self._evaluate_row(())] * num_rows
+        try:
+            return [float(value) for value in map(self.function, *args)]
+        except (ArithmeticError, TypeError, ValueError):
+            return [self._evaluate_row(values) for values in zip(*args)]
+
+    def _evaluate_row(self, values):
+        try:
+            return float(self.function(*values))
+        except (ArithmeticError, TypeError, ValueError):
+            return None
+
+
+def _power(base, exponent):
+    # in floats, so that 9 ** 9 ** 9 overflows instead of taking forever
+    return float(base) ** float(exponent)
+
+
+class _FloatPower(ast.NodeTransformer):
+    """Replaces a ** b with _power(a, b)."""
+
+    def visit_BinOp(self, node):  # pylint: disable=invalid-name
+        self.generic_visit(node)
+        if not isinstance(node.op, ast.Pow):
+            return node
+        return ast.copy_location(
+            ast.Call(ast.Name('_power', ast.Load()), [node.left, node.right],
+                     []), node)
+
+
+class FormulaEngine:
+    """A set of Formulas and the dependency graph between them."""
+
+    def __init__(self, formulas=None):
+        """formulas is a Dict[name, expression: str], in any order."""
+
+        self.formulas = {}
+        for name, expression in (formulas or {}).items():
+            self.formulas[name] = Formula(name, expression)
+        self._order = self._topological_order()
+
+    def __contains__(self, name):
+        return name in self.formulas
+
+    def _topological_order(self):
+        order = []
+        state = {}  # name -> 'visiting' or 'done'
+
+        def visit(name):
+            if state.get(name) == 'done':
+                return
+            if state.get(name) == 'visiting':
+                raise FormulaError(name, str(self.formulas[name]),
+                                   'circular dependency')
+            state[name] = 'visiting'
+            for dep in self.formulas[name].dependencies:
+                if dep in self.formulas:
+                    visit(dep)
+            state[name] = 'done'
+            order.append(name)
+
+        for name in self.formulas:
+            visit(name)
+        return order
+
+    def affected(self, changed=None):
+        """Return a List of names of formulas that need to be recomputed,
+        in the order in which to recompute them, if the columns in
+        changed (an iterable of names) changed. If changed is None,
+        return all formulas.
+
+        """
+
+        if changed is None:
+            return list(self._order)
+        dirty = set(changed)
+        result = []
+        for name in self._order:
+            if name in dirty or any(dep in dirty for dep in
+                                    self.formulas[name].dependencies):
+                dirty.add(name)
+                result.append(name)
+        return result
+
+    def outof(self, name, outofs):
+        """Return the maximum grade for formula name: its value when every
+        dependency is at its maximum. Correct for formulas that do not
+        decrease as grades increase, like weighted sums.
+
+        outofs is a Dict[asst, outof] for non-calculated columns.
+        """
+
+        if name not in self.formulas:
+            raise KeyError('No such formula: {}'.format(name))
+        needed = {name}
+        for other in reversed(self._order):
+            if other in needed:
+                needed.update(self.formulas[other].dependencies)
+
+        values = dict(outofs)
+        for other in self._order:
+            if other in needed:
+                values[other] = self.formulas[other].evaluate(values)
+        return values[name]
+
+    def recompute(self, gradebook, changed=None, grades=None):
+        """Recompute, for every student in gradebook, the formulas that
+        depend on the columns in changed (all, if None). Return the List
+        of recomputed names.
+
+        grades: if not None, an iterable of the Grades (of students in
+          gradebook) to recompute, e.g., those a merge touched; the
+          others are left as they are.
+        A student missing a grade that a formula depends on gets no
+        grade for it. A student on whom a formula cannot be evaluated
+        (e.g., it divides by 0) gets 0, with a warning.
+        """
+
+        names = self.affected(changed)
+        if grades is not None:
+            grades_list = [each for each in grades if each is not None]
+        else:
+            grades_list = [each for _, each in gradebook.studentgrades.values()
+                           if each is not None]
+        if gradebook.matrix is not None and grades is not None:
+            rows = [each.row for each in grades_list]
+            for name in names:
+                self._recompute_matrix_rows(gradebook.matrix, name, rows)
+            return names
+        if gradebook.matrix is not None:
+            live = bytearray(gradebook.matrix.num_rows)
+            for each in grades_list:
+                live[each.row] = 1
+            for name in names:
+                self._recompute_matrix(gradebook.matrix, name, live)
+            return names
+
+        self._recompute_grades(names, grades_list)
+        return names
+
+    def recompute_grades(self, grades_list, changed=None):
+        """Recompute, as recompute does, the formulas that depend on the
+        columns in changed (all, if None) in grades_list, a List of
+        Grades. Return the List of recomputed names.
+
+        """
+
+        names = self.affected(changed)
+        self._recompute_grades(names, grades_list)
+        return names
+
+    def _recompute_grades(self, names, grades_list):
+        for name in names:
+            formula = self.formulas[name]
+            columns = {dep: [grades.grades.get(dep) for grades in grades_list]
+                       for dep in formula.dependencies}
+            failed = 0
+            for i, (grades, value) in enumerate(zip(
+                    grades_list,
+                    formula.evaluate_columns(columns, len(grades_list)))):
+                if value is not None:
+                    grades.grades[name] = value
+                elif any(columns[dep][i] is None
+                         for dep in formula.dependencies):
+                    grades.grades.pop(name, None)
+                else:
+                    grades.grades[name] = 0.0
+                    failed += 1
+            _warn_failed(name, failed)
+
+    def _recompute_matrix(self, matrix, name, live):
+        """live is a mask of the rows of matrix that hold a student."""
+
+        formula = self.formulas[name]
+        columns = {}
+        masks = []
+        for dep in formula.dependencies:
+            matrix.add_column(dep)
+            columns[dep], present = matrix.column(dep)
+            masks.append(present)
+        present = bytearray(map(min, live, *masks)) if masks else live
+
+        values = formula.evaluate_columns(columns, matrix.num_rows)
+        failed = 0
+        for row, value in enumerate(values):
+            if value is None:
+                values[row] = 0.0
+                if present[row]:
+                    failed += 1
+        matrix.set_column(name, values, present)
+        _warn_failed(name, failed)
+
+    def _recompute_matrix_rows(self, matrix, name, rows):
+        """Recompute formula name in only rows, a List of row indices."""
+
+        formula = self.formulas[name]
+        columns = {}
+        masks = []
+        for dep in formula.dependencies:
+            matrix.add_column(dep)
+            column, mask = matrix.column(dep)
+            columns[dep] = [column[row] for row in rows]
+            masks.append(mask)
+        present = [all(mask[row] for mask in masks) for row in rows]
+
+        failed = 0
+        for row, value, is_present in zip(
+                rows, formula.evaluate_columns(columns, len(rows)), present):
+            if not is_present:
+                matrix.discard(row, name)
+                continue
+            if value is None:
+                value = 0.0
+                failed += 1
+            matrix.set(row, name, value)
+        _warn_failed(name, failed)
+
+
+def _warn_failed(name, failed):
+    if failed:
+        print('WARNING: Cannot compute {} for {} students. Set to 0.'.format(
+            name, failed))
+
+
+class FormulaError(Exception):
+    '''Exception raised on an invalid or circular formula.
+    '''
+
+    def __init__(self, name, expression, reason):
+        '''name: name of the calculated column
+        expression: its formula
+        reason: what is wrong with it
+        '''
+
+        message = 'Invalid formula for {}: {} ({}).'.format(
+            name, expression, reason)
+        Exception.__init__(self, message)
+        self.name = name
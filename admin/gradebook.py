@@ -1,23 +1,45 @@
 """My gradebook."""
 
+from array import array
+from concurrent.futures import ProcessPoolExecutor
 import json
 import math
+from operator import itemgetter
+import os
 import re
-
-from .defaults import default_student_sort, DEFAULT_FORMULA_OUTOF
-from .shared import _make_gf_header, _make_gf_student_line, _make_csv_header
-from .students import Student, Students
+import time
+
+from .columns import GradeMatrix
+from .defaults import (default_student_sort, DEFAULT_FORMULA_OUTOF,
+                       DEFAULT_OUTOF, STUDENT_NUMBER_LENGTH)
+from .formulas import Formula, FormulaEngine, FormulaError
+from .shared import (GF_STUDENT_LINE, GF_COMMENT_LINE, _make_gf_header,
+                     _gf_student_line_maker, _csv_row_maker, _is_gf_utorid,
+                     _make_csv_header, _open_for_writing, _write_lines,
+                     _SortedViews)
+from .snapshot import SnapshotReader, SnapshotWriter, SnapshotError
+from .students import (Student, Students, _write_student_columns,
+                       _read_student_columns)
 
 SEARCH_BY = ('student_number', 'utorid', 'gitid')
 
 DEBUG = True
 
+# how merges resolve a grade present in both GradeBooks:
+# newest: take the incoming grade; max: take the higher grade;
+# keep: keep the existing grade
+MERGE_POLICIES = ('newest', 'max', 'keep')
+
+# kind of snapshot files of GradeBooks
+SNAPSHOT_KIND = b'G'
+
 
 class GradeBook:
     """My own gradebook."""
 
     def __init__(self, studentgrades=None, dict_key='student_number',
-                 outofs=None, comments=None, sanity_check=True):
+                 outofs=None, comments=None, sanity_check=True,
+                 columnar=False, formulas=None):
         """Init a Gradesfile given:
 
         outofs: Dict[str, float] maps assigment name to max possible grade.
@@ -26,6 +48,9 @@ class GradeBook:
         studentgrades: Dict[dict_key, Tuple(Student, Grades)].
         comments: Dict[dict_key, str].
         sanity_check: check created GradeBook for inconsistencies or errors?
+        columnar: store all grades in a single GradeMatrix (see to_columnar)?
+        formulas: Dict[str, str] maps calculated assignment name to its
+           gf formula (see set_formula).
 
         """
 
@@ -33,9 +58,194 @@ class GradeBook:
         self.studentgrades = dict(studentgrades) if studentgrades else {}
         self.dict_key = dict_key
         self.comments = dict(comments) if comments else {}
+        self.formulas = dict(formulas) if formulas else {}
+        self._engine = None
+        # Dict[attribute, Dict[attr_value, dict_key]] for SEARCH_BY
+        self._index = {}
+        self._sorted_views = _SortedViews()
+        self._reindex()
+        self.matrix = None
+        if columnar:
+            self.to_columnar()
         if sanity_check:
             self.sanity_check()
 
+    def _reindex(self):
+        """Rebuild the SEARCH_BY indexes from scratch."""
+
+        self._index = {attribute: {} for attribute in SEARCH_BY}
+        self._sorted_views.invalidate()
+        for key, (student, _) in self.studentgrades.items():
+            self._index_student(key, student)
+
+    def _index_student(self, key, student):
+        for attribute, index in self._index.items():
+            attr_value = getattr(student, attribute, None)
+            if attr_value is not None:
+                index.setdefault(attr_value, key)
+
+    def _unindex_student(self, key, student):
+        for attribute, index in self._index.items():
+            attr_value = getattr(student, attribute, None)
+            if attr_value is not None and index.get(attr_value) == key:
+                del index[attr_value]
+
+    def _lookup(self, attribute, attr_value):
+        """Return the (Student, Grades) record whose attribute is
+        attr_value, or None if there is no such record. attribute must
+        be one of SEARCH_BY.
+
+        """
+
+        key = self._index[attribute].get(attr_value)
+        if key is None:
+            return None
+        record = self.studentgrades.get(key)
+        if record is None or getattr(record[0], attribute) != attr_value:
+            # studentgrades was modified behind our back
+            self._reindex()
+            key = self._index[attribute].get(attr_value)
+            return None if key is None else self.studentgrades[key]
+        return record
+
+    def add_student_grades(self, student, grades, comment=None):
+        """Add (or replace) student with their grades, and a comment if
+        given. Always use this (and remove_student) rather than
+        modifying studentgrades directly, so that the lookup indexes
+        stay up to date.
+
+        """
+
+        key = getattr(student, self.dict_key)
+        self.remove_student(key)
+        if self.matrix is not None:
+            grades = self._to_row(grades)
+        self.studentgrades[key] = (student, grades)
+        self._index_student(key, student)
+        self._sorted_views.invalidate()
+        if comment:
+            self.comments[key] = comment
+
+    def remove_student(self, key):
+        """Remove the Student with dict_key key, together with their grades
+        and comment. Return the removed (Student, Grades), or None if
+        there is no such Student.
+
+        """
+
+        record = self.studentgrades.pop(key, None)
+        self.comments.pop(key, None)
+        if record is not None:
+            self._unindex_student(key, record[0])
+            self._sorted_views.invalidate()
+            if isinstance(record[1], GradeRow):
+                row = record[1].row
+                record = (record[0], Grades(record[1].grades))
+                self.matrix.drop_row(row)
+        return record
+
+    def to_columnar(self):
+        """Move all grades into a single GradeMatrix, replacing every Grades
+        with a GradeRow view of its row. Memory use becomes a float and
+        a byte per grade, and whole assignments can be processed at
+        once with get_column.
+
+        """
+
+        if self.matrix is not None:
+            return
+        self.matrix = GradeMatrix(self.outofs)
+        for key, (student, grades) in self.studentgrades.items():
+            self.studentgrades[key] = (student, self._to_row(grades))
+        self._sorted_views.invalidate()  # views hold the old records
+
+    def _to_row(self, grades):
+        if grades is None or (isinstance(grades, GradeRow) and
+                              grades.matrix is self.matrix):
+            return grades
+        row = self.matrix.add_row()
+        for asst, grade in grades.grades.items():
+            self.matrix.set(row, asst, grade)
+        return GradeRow(self.matrix, row)
+
+    def sorted_records(self, key=default_student_sort):
+        """Return a List[(Student, Grades)] of all records, sorted by
+        key(Student). The List is cached until this GradeBook's students
+        change (through add_student_grades, remove_student, or to_key),
+        so do not modify it; call invalidate_sorted after changing
+        Students' attributes in place.
+
+        """
+
+        return self._sorted_views.get(self.studentgrades, key, itemgetter(0))
+
+    def invalidate_sorted(self):
+        """Forget cached sorted_records, e.g., after renaming a Student."""
+
+        self._sorted_views.invalidate()
+
+    def get_column(self, asst):
+        """Return a List of all recorded grades for assignment asst."""
+
+        if self.matrix is not None:
+            return self.matrix.values(asst)
+        return [grades.grades[asst]
+                for _, grades in self.studentgrades.values()
+                if grades is not None and asst in grades.grades]
+
+    def add_assignment(self, asst, outof, grades=None, default=0.0):
+        """Add (or replace) assignment asst with maximum grade outof.
+
+        grades is a Dict[dict_key, grade]; every Student not in grades
+        gets the default grade.
+        """
+
+        asst = _clean_asst(asst)
+        self.outofs[asst] = _clean_grade(outof)
+        if grades is None:
+            grades = {}
+        for key, (_, student_grades) in self.studentgrades.items():
+            if student_grades is not None:
+                student_grades.add_grade(asst, grades.get(key, default))
+        if asst in self.formulas:  # no longer calculated
+            del self.formulas[asst]
+            self._engine = None
+        if self.formulas:
+            self.recompute([asst])
+
+    def set_formula(self, asst, formula):
+        """Make asst a calculated assignment given by gf formula (e.g.,
+        '0.4 * exam + 0.6 * project'), set its outof and compute it for
+        all students. Raise FormulaError if formula is invalid or uses
+        an unknown assignment.
+
+        """
+
+        formulas = dict(self.formulas)
+        formulas[asst] = formula
+        engine = FormulaEngine(formulas)
+        for dep in engine.formulas[asst].dependencies:
+            if dep not in self.outofs and dep not in formulas:
+                raise FormulaError(asst, formula,
+                                   'unknown assignment {}'.format(dep))
+        self.formulas, self._engine = formulas, engine
+        self.outofs[asst] = _formula_outof(engine, asst, self.outofs)
+        self.recompute([asst])
+
+    def recompute(self, changed=None, grades=None):
+        """Recompute calculated assignments that depend on the assignments
+        in changed (an iterable of names), or all calculated
+        assignments if changed is None. Return the List of recomputed
+        assignments.
+
+        grades: if not None, recompute only these Grades of this
+        GradeBook's students.
+        """
+
+        if self._engine is None:
+            self._engine = FormulaEngine(self.formulas)
+        return self._engine.recompute(self, changed, grades)
+
     def sanity_check(self):
         """Check validity of this GradeBook."""
 
@@ -50,10 +260,17 @@ class GradeBook:
     def __iter__(self):
         return iter(self.studentgrades)
 
+    def __getstate__(self):
+        # compiled formulas and cached views are rebuilt on demand
+        state = dict(self.__dict__)
+        state['_engine'] = None
+        state['_sorted_views'] = _SortedViews()
+        return state
+
     def __str__(self):
         result = str(self.outofs) + '\n\n'
 
-        student_list = _sorted_student_grades(self.studentgrades)
+        student_list = self.sorted_records()
         for student, grades in student_list:
             key = getattr(student, self.dict_key)
             result += '{}: {},{},{}\n'.format(
@@ -88,15 +305,186 @@ class GradeBook:
                 return False
         return True
 
+    def merge(self, other, policy='newest'):
+        """Upsert all students, grades, outofs, formulas and comments of
+        GradeBook other into this GradeBook. Students are matched on
+        any of SEARCH_BY; grades present in both are resolved by policy,
+        one of MERGE_POLICIES. Return the List of added Students.
+
+        """
+
+        return self.merge_records(
+            ((student, grades, other.comments.get(key))
+             for key, (student, grades) in other.studentgrades.items()),
+            policy, other.outofs, other.formulas)
+
+    def merge_records(self, records, policy='newest', outofs=None,
+                      formulas=None):
+        """Upsert records, an iterable of (Student, Grades, comment) such as
+        iter_gf_records produces, into this GradeBook. See merge.
+
+        outofs, formulas: of the assignments in records that are not in
+          this GradeBook yet (and, unless policy is keep, updated ones).
+        Every Student ends up with a grade for every assignment: 0 if
+        there is none.
+        """
+
+        _check_policy(policy)
+        old_formulas = dict(self.formulas)
+        new_assts = self._merge_outofs(outofs, formulas, policy)
+
+        added = []
+        touched = []  # Grades of existing Students that may have changed
+        new_grades = []  # Grades of added Students
+        written = set(outofs or ())  # assignments that may have changed
+        for student, grades, comment in records:
+            incoming = grades.grades if grades is not None else {}
+            written.update(incoming)
+            record = self.get_student_info(
+                {attr: getattr(student, attr) for attr in SEARCH_BY
+                 if getattr(student, attr) is not None})
+            if record is None:
+                if getattr(student, self.dict_key) is None:
+                    print('WARNING: Cannot add Student with no {}:\n\t{}'.format(
+                        self.dict_key, student))
+                    continue
+                grades = Grades()
+                grades.set_clean_grades(dict.fromkeys(self.outofs, 0.0))
+                grades.set_clean_grades(incoming)
+                self.add_student_grades(student, grades, comment)
+                added.append(student)
+                new_grades.append(self.studentgrades[
+                    getattr(student, self.dict_key)][1])
+                continue
+
+            existing, existing_grades = record
+            key = getattr(existing, self.dict_key)
+            if existing_grades is None:
+                self.add_student_grades(existing, Grades(),
+                                        self.comments.get(key))
+                existing_grades = self.studentgrades[key][1]
+            _merge_grades(existing_grades, incoming, policy)
+            touched.append(existing_grades)
+            if comment and (policy != 'keep' or not self.comments.get(key)):
+                self.comments[key] = comment
+
+        self._fill_missing(new_assts)
+        self._recompute_merged(written, touched, new_grades, new_assts,
+                               old_formulas)
+        return added
+
+    def merge_columns(self, columns, key='student_number', policy='newest',
+                      outofs=None):
+        """Upsert grades from columns, a Dict[asst, Dict[attr_value, grade]]
+        such as get_grades_columns produces, where attr_value is the
+        value of Student attribute key. Grades are resolved by policy
+        (see merge). outofs is a Dict[asst, outof] for new (or updated)
+        assignments; new assignments not in outofs get DEFAULT_OUTOF.
+        Return the List of attr_values that match no Student.
+
+        """
+
+        _check_policy(policy)
+        outofs = dict(outofs) if outofs else {}
+        for asst in columns:
+            if asst not in self.outofs and asst not in outofs:
+                outofs[asst] = DEFAULT_OUTOF
+        new_assts = self._merge_outofs(outofs, None, policy)
+
+        by_student = {}
+        for asst, column in columns.items():
+            asst = _clean_asst(asst)
+            for attr_value, grade in column.items():
+                by_student.setdefault(attr_value, {})[asst] = (
+                    _clean_grade(grade))
+
+        unmatched = []
+        touched = []
+        for attr_value, incoming in by_student.items():
+            if key in self._index:
+                record = self._lookup(key, attr_value)
+            else:
+                record = self.get_student_info({key: attr_value})
+            if record is None or record[1] is None:
+                unmatched.append(attr_value)
+                continue
+            _merge_grades(record[1], incoming, policy)
+            touched.append(record[1])
+
+        self._fill_missing(new_assts)
+        self._recompute_merged(
+            [_clean_asst(asst) for asst in columns], touched, [], new_assts,
+            self.formulas)
+        return unmatched
+
+    def _recompute_merged(self, written, touched, new_grades, new_assts,
+                          old_formulas):
+        """Recompute after a merge, so that its cost is proportional to the
+        merged data: the calculated assignments that depend on written
+        for the touched Grades, all of them for new_grades, and those
+        that depend on new_assts or whose formulas are not old_formulas
+        for everyone.
+
+        """
+
+        if not self.formulas:
+            return
+        if touched:
+            self.recompute(written, touched)
+        if new_grades:
+            self.recompute(None, new_grades)
+        everyone = list(new_assts) + [
+            asst for asst, formula in self.formulas.items()
+            if old_formulas.get(asst) != formula]
+        if everyone:
+            self.recompute(everyone)
+
+    def _merge_outofs(self, outofs, formulas, policy):
+        """Add (or update, unless policy is keep) outofs and formulas.
+        Return the List of newly added assignments."""
+
+        new_assts = []
+        for asst, outof in (outofs or {}).items():
+            if asst not in self.outofs:
+                new_assts.append(asst)
+            elif policy == 'keep':
+                continue
+            self.outofs[asst] = outof
+            if formulas and asst in formulas:
+                self.formulas[asst] = formulas[asst]
+                self._engine = None
+        return new_assts
+
+    def _fill_missing(self, assts):
+        """Give every Student without a grade for assts a 0."""
+
+        if not assts:
+            return
+        for _, grades in self.studentgrades.values():
+            if grades is not None:
+                current = grades.grades
+                grades.set_clean_grades({asst: 0.0 for asst in assts
+                                         if asst not in current})
+
     def get_student_info(self, search_by):
         """search_by is a Dict[attribute, attr_value]. Return (Student,
         Grades) if a Student matches any of the search_by, or None if
         no such Student."""
 
-        for student, grades in self.studentgrades.values():
-            if any(getattr(student, attribute) == attr_value
-                   for attribute, attr_value in search_by.items()):
-                return (student, grades)
+        unindexed = {}
+        for attribute, attr_value in search_by.items():
+            if attribute not in self._index:
+                unindexed[attribute] = attr_value
+                continue
+            record = self._lookup(attribute, attr_value)
+            if record is not None:
+                return record
+
+        if unindexed:
+            for student, grades in self.studentgrades.values():
+                if any(getattr(student, attribute) == attr_value
+                       for attribute, attr_value in unindexed.items()):
+                    return (student, grades)
         return None
 
     def get_students(self):
@@ -125,9 +513,14 @@ class GradeBook:
 
         """
 
-        for student, grades in self.studentgrades.values():
-            if getattr(student, attribute) == attr_value:
-                return grades
+        if attribute in self._index:
+            record = self._lookup(attribute, attr_value)
+            if record is not None:
+                return record[1]
+        else:
+            for student, grades in self.studentgrades.values():
+                if getattr(student, attribute) == attr_value:
+                    return grades
         raise Exception('No student with {} value {}.'.format(
             attribute, attr_value))
 
@@ -154,37 +547,134 @@ class GradeBook:
         return new_key_to_student_grades
 
     @staticmethod
-    def load_gf_file(infile, dict_key='student_number', use_utorid=True):
+    def load_gf_file(infile, dict_key='student_number', use_utorid=True,
+                     columnar=False):
         """Read gf grades file and create a new GradeBook. This GradeBook will
-        have dict_key as its dictionary key.
+        have dict_key as its dictionary key, and will be columnar if
+        columnar is True.
 
         """
 
-        lines = infile.readlines()
-        sep = lines.index('\n')
-
-        header = lines[:sep + 1]
-        assts, outofs = _make_out_of_from_gf_header(header)
+        assts, outofs, formulas = read_gf_header(infile)
 
         stnum_to_student_grades = {}  # gf files are by student number
         stnum_to_comment = {}
-        for line in lines[sep + 1:]:
-            student = Student.make_student_from_gf_line(line, use_utorid)
-            if not student:  # this is a comment/individual formula line
-                stnum, comment = _make_comment_from_gf_line(line)
-                stnum_to_comment[stnum] = comment
-                continue
-
-            grades = Grades.make_grades_from_gf_line(line, assts)
+        other_comments = {}  # comments not right after their student
+        for student, grades, comment in iter_gf_records(
+                infile, assts, use_utorid, other_comments):
             stnum_to_student_grades[student.student_number] = (student, grades)
+            if comment is not None:
+                stnum_to_comment[student.student_number] = comment
+        for stnum, comment in other_comments.items():
+            stnum_to_comment.setdefault(stnum, comment)
 
         gradebook = GradeBook(stnum_to_student_grades,
                               'student_number', outofs,
-                              stnum_to_comment)
+                              stnum_to_comment, columnar=columnar,
+                              formulas=formulas)
 
         gradebook.to_key(dict_key)
         return gradebook
 
+    def save_snapshot(self, path, source=None):
+        """Save this GradeBook to a binary snapshot file path. source is the
+        path of the gf file it was loaded from, if any: the snapshot is
+        stale once source changes.
+
+        """
+
+        records = list(self.studentgrades.items())
+        assts = list(self.outofs)
+
+        writer = SnapshotWriter(SNAPSHOT_KIND, source)
+        writer.add_strings([self.dict_key])
+        writer.add_strings(assts)
+        writer.add_array(array('d', self.outofs.values()))
+        writer.add_strings(self.formulas.keys())
+        writer.add_strings(self.formulas.values())
+        writer.add_bytes([self.matrix is not None])
+        writer.add_bytes([grades is not None for _, (_, grades) in records])
+        _write_student_columns(writer, [student for _, (student, _) in records])
+        writer.add_strings([self.comments.get(key) for key, _ in records])
+        for asst in assts:
+            column = array('d')
+            present = bytearray()
+            for _, (_, grades) in records:
+                try:
+                    column.append(grades.get_grade(asst))
+                    present.append(1)
+                except (KeyError, AttributeError):  # no grade, or no Grades
+                    column.append(0.0)
+                    present.append(0)
+            writer.add_array(column)
+            writer.add_bytes(present)
+        writer.save(path)
+
+    @staticmethod
+    def load_snapshot(path, source=None, dict_key=None, use_utorid=True,
+                      columnar=None):
+        """Return a new GradeBook loaded from the snapshot file path. If the
+        snapshot is missing, stale, or corrupt, load the gf file source
+        instead (as in load_gf_file) and save a fresh snapshot. Raise
+        SnapshotError if that is not possible because source is None.
+
+        dict_key, columnar: if not None, convert the loaded GradeBook
+          (see to_key and to_columnar).
+        """
+
+        try:
+            gradebook = _read_gradebook_snapshot(
+                SnapshotReader(path, SNAPSHOT_KIND, source))
+        except SnapshotError as error:
+            if source is None:
+                raise
+            print('WARNING: {} Loading {}.'.format(error, source))
+            with open(source, encoding='utf-8') as infile:
+                gradebook = GradeBook.load_gf_file(infile, 'student_number',
+                                                   use_utorid, bool(columnar))
+            gradebook.save_snapshot(path, source)
+
+        if dict_key is not None:
+            gradebook.to_key(dict_key)
+        if columnar:
+            gradebook.to_columnar()
+        return gradebook
+
+    @staticmethod
+    def load_gf_files(paths, dict_key='student_number', use_utorid=True,
+                      policy='newest', processes=None):
+        """Load all gf files in paths, in parallel, and merge them into a
+        single new GradeBook with dict_key as its dictionary key.
+        Return (GradeBook, timings), where timings is a Dict[path,
+        seconds] of the time taken to load each file.
+
+        Files are merged in the order of paths, as in merge, according
+        to policy. processes is the number of worker processes (default:
+        one per CPU); with 1, files are loaded in this process.
+        """
+
+        paths = list(paths)
+        if processes is None:
+            processes = os.cpu_count() or 1
+        if processes == 1 or len(paths) <= 1:
+            results = [_load_gf_path(path, use_utorid) for path in paths]
+        else:
+            with ProcessPoolExecutor(processes) as executor:
+                results = list(executor.map(
+                    _load_gf_path, paths, [use_utorid] * len(paths)))
+
+        timings = {}
+        gradebook = GradeBook()
+        for path, (partial, seconds) in zip(paths, results):
+            start = time.perf_counter()
+            if gradebook.outofs or len(gradebook):
+                gradebook.merge(partial, policy)
+            else:
+                gradebook = partial
+            timings[path] = seconds + time.perf_counter() - start
+        gradebook.to_key(dict_key)
+        return gradebook, timings
+
     def to_key(self, key):
         """Convert this Gradebook's dictionaries of student_grades and
         comments to have the new key."""
@@ -209,10 +699,11 @@ class GradeBook:
         self.studentgrades = dict_key_to_student_grades
         self.comments = dict_key_to_comments
         self.dict_key = key
+        self._reindex()
 
     def write_gf(self, outfile, assts=None, utorid=True,
                  key=default_student_sort):
-        """Write a gf file to outfile.
+        """Write a gf file to outfile: a file open for writing, or a path.
 
         assts is an iterable of asst names: the order in which they
         will appear in the gf.  If assts is None, the order will be
@@ -222,15 +713,17 @@ class GradeBook:
         """
 
         outofs = _sort_outofs(self.outofs, assts)
-        header = _make_gf_header(outofs, utorid)
-        outfile.write(header + '\n')
-
-        student_grades_list = _sorted_student_grades(self.studentgrades, key)
-        for student, grades in student_grades_list:
-            comment = self.comments.get(getattr(student, self.dict_key), '')
-            line = _make_gf_student_line(
-                student, utorid, grades, outofs, comment)
-            outfile.write(line)
+        header = _make_gf_header(outofs, utorid, self.formulas)
+        make_line = _gf_student_line_maker(utorid, outofs)
+        comments, dict_key = self.comments, self.dict_key
+
+        student_grades_list = self.sorted_records(key)
+        with _open_for_writing(outfile) as out:
+            out.write(header + '\n')
+            _write_lines(out, (
+                make_line(student, grades,
+                          comments.get(getattr(student, dict_key), ''))
+                for student, grades in student_grades_list))
 
     def get_grades_dict(self, asst, key='student_number'):
         """Return Dict[key, grade:float] of grades for assignment asst.
@@ -238,15 +731,31 @@ class GradeBook:
         asst is the assignment name for which the grades will be collected.
         """
 
-        return {getattr(student, key):
-                self.get_student_grades_by_student_number(
-                    student.student_number).get_grade(asst)
-                for student in self.get_students()}
+        return self.get_grades_columns([asst], key)[asst]
+
+    def get_grades_columns(self, assts=None, key='student_number'):
+        """Return Dict[asst, Dict[key, grade:float]] of grades for each
+        assignment in assts, collected in a single pass over the
+        students.
+
+        assts is an iterable of assignment names; if None, all
+        assignments in outofs are included.
+        key is a Student attribute to key each column by.
+        """
+
+        assts = list(self.outofs if assts is None else assts)
+        columns = {asst: {} for asst in assts}
+        for student, grades in self.studentgrades.values():
+            attr_value = getattr(student, key)
+            for asst, column in columns.items():
+                column[attr_value] = grades.get_grade(asst)
+        return columns
 
     def write_csv_grades_file(self, outfile, student_attrs=None,
                               header=True, comments=True, assts=None,
                               key=default_student_sort, names=None):
-        """Write a csv grades file to outfile.
+        """Write a csv grades file to outfile: a file open for writing, or a
+        path.
 
         student_attrs is an iterable of Student attributes to be
            included in the file, in the order in which they will
@@ -268,24 +777,30 @@ class GradeBook:
         if assts is None:
             assts = []
 
-        if header:
-            outfile.write(_make_csv_header(
-                student_attrs, assts, comments, names))
-
-        student_grades_list = _sorted_student_grades(self.studentgrades, key)
-        for student, grades in student_grades_list:
-            student_grades = ''.join(
-                [',{}'.format(grades.get_grade(asst)) for asst in assts])
-            student_comment = (',{}'.format(self.comments.get(
-                getattr(student, self.dict_key), '')) if comments else '')
-            outfile.write('{}{}{}\n'.format(
-                student.full_str(student_attrs),
-                student_grades,
-                student_comment))
+        make_row = _csv_row_maker(student_attrs)
+
+        def make_line(student, grades):
+            parts = [make_row(student)]
+            parts.extend([',{}'.format(grades.get_grade(asst))
+                          for asst in assts])
+            if comments:
+                parts.append(',{}'.format(self.comments.get(
+                    getattr(student, self.dict_key), '')))
+            parts.append('\n')
+            return ''.join(parts)
+
+        student_grades_list = self.sorted_records(key)
+        with _open_for_writing(outfile) as out:
+            if header:
+                out.write(_make_csv_header(
+                    student_attrs, assts, comments, names))
+            _write_lines(out, (make_line(student, grades)
+                               for student, grades in student_grades_list))
 
     def write_csv_submit_file(self, outfile, asst='all',
                               exam_no_shows=None, attribute='student_number'):
-        """Write a CSV submit file for eMarks to outfile.
+        """Write a CSV submit file for eMarks to outfile: a file open for
+        writing, or a path.
 
         asst is the name of the "final mark" assignment
         exam_no_shows is an iterable of values of attribute of Student's
@@ -295,20 +810,26 @@ class GradeBook:
         if exam_no_shows is None:
             exam_no_shows = []
 
-        for student, grades in self.studentgrades.values():
-            try:
-                grade = grades.get_grade(asst)
-            except KeyError:
-                print('WARNING: '
-                      'No grade for assignment {} for student:\n\t{}'.format(
-                          asst, student))
-                continue
+        exam_no_shows = set(exam_no_shows)
+
+        def make_lines():
+            for student, grades in self.studentgrades.values():
+                try:
+                    grade = grades.get_grade(asst)
+                except KeyError:
+                    print('WARNING: '
+                          'No grade for assignment {} for student:\n\t{}'.format(
+                              asst, student))
+                    continue
 
-            no_show = getattr(student, attribute) in exam_no_shows
-            outfile.write('{},{}{}\n'.format(student.student_number,
-                                             # submit file needs integers
-                                             min(math.ceil(grade), 100),
-                                             ',y' if no_show else ''))
+                no_show = getattr(student, attribute) in exam_no_shows
+                yield '{},{}{}\n'.format(student.student_number,
+                                         # submit file needs integers
+                                         min(math.ceil(grade), 100),
+                                         ',y' if no_show else '')
+
+        with _open_for_writing(outfile) as out:
+            _write_lines(out, make_lines())
 
 
 class Grades:
@@ -341,6 +862,14 @@ class Grades:
         for assignment, grade in grades:
             self.add_grade(assignment, grade)
 
+    def set_clean_grades(self, grades):
+        """Add/update grades from grades, a Dict[asst, grade:float] that has
+        already been cleaned (e.g., comes from other Grades).
+
+        """
+
+        self.grades.update(grades)
+
     def get_grade(self, assignment):
         """Return the grade for assignment. Raise KeyError if no such
         assignment.
@@ -365,26 +894,35 @@ class Grades:
         """
 
         fields = line.strip().split(',')
-        match = re.fullmatch(
-            r'(\d+) [ dx][ dx] ([^,]+)((\s+([^,]+))+)', fields[0])
+        match = GF_STUDENT_LINE.fullmatch(fields[0])
 
         # this is not a gf line with student information
         if match is None:
             return None
 
+        return Grades._make_grades_from_gf_fields(fields, assts)
+
+    @staticmethod
+    def _make_grades_from_gf_fields(fields, assts):
+        """Create Grades from a student line in a gf file, already split
+        into fields. assts must be clean assignment names.
+
+        """
+
         grades = Grades()
 
         if len(fields) == 1:
             return grades
 
-        if not fields[1].isdigit():  # line contains utorid
+        if _is_gf_utorid(fields[1]):  # line contains utorid
             fields = fields[2:]
         else:
             fields = fields[1:]
 
         # pad with zeros for missing grades
-        grades.add_grades(
-            zip(assts, fields + [0] * (len(assts) - len(fields))))
+        grades.grades = dict(zip(assts, map(_clean_grade, fields)))
+        for asst in assts[len(fields):]:
+            grades.grades[asst] = 0.0
         return grades
 
     def to_json(self):
@@ -408,6 +946,111 @@ class Grades:
         return True
 
 
+class GradeRow(Grades):
+    """Grades of one student, stored as a row of a GradeMatrix."""
+
+    def __init__(self, matrix, row):
+        # pylint: disable=super-init-not-called
+        self.matrix = matrix
+        self.row = row
+
+    @property
+    def grades(self):
+        """Dict[asst, grade] of the grades in this row."""
+
+        return self.matrix.row_dict(self.row)
+
+    def __iter__(self):
+        return iter(self.matrix.row_assts(self.row))
+
+    def add_grade(self, assignment, grade=0):
+        grade = _clean_grade(grade)
+        assignment = _clean_asst(assignment)
+        self.matrix.set(self.row, assignment, grade)
+
+    def set_clean_grades(self, grades):
+        for assignment, grade in grades.items():
+            self.matrix.set(self.row, assignment, grade)
+
+    def get_grade(self, assignment):
+        return self.matrix.get(self.row, assignment)
+
+    def get_assignments(self):
+        return set(self.matrix.row_assts(self.row))
+
+
+def _read_gradebook_snapshot(reader):
+    """Return a new GradeBook read from the SnapshotReader reader, as
+    written by GradeBook.save_snapshot."""
+
+    dict_key = reader.next_strings()[0]
+    assts = reader.next_strings()
+    outofs = dict(zip(assts, reader.next_array('d')))
+    formulas = dict(zip(reader.next_strings(), reader.next_strings()))
+    columnar = reader.next_bytes()[0]
+    has_grades = reader.next_bytes()
+    students = _read_student_columns(reader)
+    comments = reader.next_strings()
+    columns = [(reader.next_array('d'), reader.next_bytes()) for _ in assts]
+
+    if columnar:
+        matrix = GradeMatrix(assts)
+        rows = matrix.add_rows(len(students))
+        for asst, (column, present) in zip(assts, columns):
+            matrix.set_column(asst, column, present)
+        gradess = [GradeRow(matrix, row) for row in rows]
+    else:
+        matrix = None
+        gradess = [Grades() for _ in students]
+        for grades, values in zip(gradess, zip(*(column
+                                                 for column, _ in columns))):
+            grades.grades = dict(zip(assts, values))
+        for asst, (_, present) in zip(assts, columns):
+            if present.count(0):
+                for grades, is_present in zip(gradess, present):
+                    if not is_present:
+                        del grades.grades[asst]
+
+    studentgrades = {}
+    key_to_comment = {}
+    for student, grades, grades_present, comment in zip(
+            students, gradess, has_grades, comments):
+        key = getattr(student, dict_key)
+        studentgrades[key] = (student, grades if grades_present else None)
+        if comment is not None:
+            key_to_comment[key] = comment
+
+    gradebook = GradeBook(studentgrades, dict_key, outofs, key_to_comment,
+                          sanity_check=False, formulas=formulas)
+    gradebook.matrix = matrix
+    return gradebook
+
+
+def _check_policy(policy):
+    if policy not in MERGE_POLICIES:
+        raise ValueError('Invalid merge policy: {}. Use one of {}.'.format(
+            policy, MERGE_POLICIES))
+
+
+def _merge_grades(grades, incoming, policy):
+    """Merge incoming, a Dict[asst, grade:float], into Grades grades
+    according to policy."""
+
+    if policy == 'newest':
+        grades.set_clean_grades(incoming)
+        return
+    current = grades.grades
+    if policy == 'keep':
+        grades.set_clean_grades({asst: grade
+                                 for asst, grade in incoming.items()
+                                 if asst not in current})
+    else:  # max
+        grades.set_clean_grades({asst: grade
+                                 for asst, grade in incoming.items()
+                                 if asst not in current or
+                                 grade > current[asst]})
+
+
 def _clean_grade(grade):
     if grade == '' or str(grade).lower() == 'gwr':
         return 0.0
@@ -427,9 +1070,9 @@ def _clean_asst(assignment):
 
 
 def _make_out_of_from_gf_header(header):
-    # TODO FIX collecting calculated grades
     outofs = {}
     assts = []
+    formulas = {}
     for line in header:
         match = re.fullmatch(r'(\w+)\s*/\s*(\d+)\n', line)
         if match:
@@ -438,18 +1081,138 @@ def _make_out_of_from_gf_header(header):
             outofs[asst] = outof
             assts.append(asst)
             continue
-        match = re.match(r'(\w+)\s*=', line)  # calculated grade
+        match = re.match(r'(\w+)\s*=(.*)', line)  # calculated grade
         if match:
             asst = _clean_asst(match.group(1))
-            outof = DEFAULT_FORMULA_OUTOF
-            outofs[asst] = outof
+            formulas[asst] = match.group(2).strip()
             assts.append(asst)
             continue
-    return (assts, outofs)
+
+    formulas = _valid_formulas(formulas, assts)
+    engine = FormulaEngine(formulas)
+    for asst in assts:
+        if asst not in outofs and asst not in formulas:  # invalid formula
+            outofs[asst] = DEFAULT_FORMULA_OUTOF
+    for asst in formulas:
+        outofs[asst] = _formula_outof(engine, asst, outofs)
+    return (assts, {asst: outofs[asst] for asst in assts}, formulas)
+
+
+def _valid_formulas(formulas, assts):
+    """Return a Dict with those of formulas that are valid, use only
+    assignments in assts, and are not circular. Print a warning for
+    each other one: its column is kept as a plain column.
+
+    """
+
+    valid = {}
+    for asst, expression in formulas.items():
+        try:
+            unknown = [dep for dep in Formula(asst, expression).dependencies
+                       if dep not in assts]
+            if unknown:
+                raise FormulaError(asst, expression, 'unknown assignment {}'
+                                   .format(', '.join(unknown)))
+        except FormulaError as error:
+            print('WARNING: {} Keeping {} as a plain column.'.format(
+                error, asst))
+            continue
+        valid[asst] = expression
+
+    while True:
+        try:
+            FormulaEngine(valid)
+            return valid
+        except FormulaError as error:
+            print('WARNING: {} Keeping {} as a plain column.'.format(
+                error, error.name))
+            del valid[error.name]
+
+
+def _formula_outof(engine, asst, outofs):
+    """Return the outof of calculated assignment asst, or
+    DEFAULT_FORMULA_OUTOF if it cannot be calculated from outofs.
+
+    """
+
+    try:
+        return engine.outof(asst, outofs)
+    except (KeyError, ArithmeticError, TypeError):
+        return DEFAULT_FORMULA_OUTOF
+
+
+def _load_gf_path(path, use_utorid=True):
+    """Return (GradeBook, seconds): the GradeBook in gf file path, and how
+    long it took to load it. Used by GradeBook.load_gf_files."""
+
+    start = time.perf_counter()
+    with open(path, encoding='utf-8') as infile:
+        gradebook = GradeBook.load_gf_file(infile, 'student_number',
+                                           use_utorid)
+    return gradebook, time.perf_counter() - start
+
+
+def read_gf_header(infile):
+    """Read the header of a gf file from infile, up to and including the
+    first blank line. Return (assts, outofs, formulas), where assts is
+    a List of assignment names in the order of the gf columns.
+
+    """
+
+    header = []
+    for line in infile:
+        header.append(line)
+        if not line.strip():
+            break
+    return _make_out_of_from_gf_header(header)
+
+
+def iter_gf_records(infile, assts, use_utorid=True, other_comments=None):
+    """Yield (Student, Grades, comment) for each student line in the rest
+    of the gf file infile (after read_gf_header). comment is None if
+    the student has no comment. Only one record is held in memory at a
+    time, so this works on gf files of any size.
+
+    assts is the List of gf columns, as returned by read_gf_header.
+    other_comments: if a Dict, comments that do not directly follow
+      their student line are added to it, keyed by student number,
+      instead of being skipped with a warning.
+    """
+
+    pending = None
+    for line in infile:
+        fields = line.strip().split(',')
+        match = GF_STUDENT_LINE.fullmatch(fields[0])
+        if match is not None:
+            if pending is not None:
+                yield pending
+            pending = (
+                Student._make_student_from_gf_fields(match, fields,
+                                                     use_utorid),
+                Grades._make_grades_from_gf_fields(fields, assts),
+                None)
+            continue
+
+        comment = _make_comment_from_gf_line(line)
+        if comment is None:
+            if line.strip():
+                print('WARNING: Skipping gf line:\n\t{}'.format(line.strip()))
+            continue
+        stnum = comment[0].zfill(STUDENT_NUMBER_LENGTH)
+        if pending is not None and stnum == pending[0].student_number:
+            pending = (pending[0], pending[1], comment[1])
+        elif other_comments is not None:
+            other_comments[stnum] = comment[1]
+        else:
+            print('WARNING: Comment not following its student:\n\t{}'.format(
+                line.strip()))
+
+    if pending is not None:
+        yield pending
 
 
 def _make_comment_from_gf_line(line):
-    match = re.fullmatch(r'(\d+)[*]\s+(.+)', line.strip())
+    match = GF_COMMENT_LINE.fullmatch(line.strip())
     if match:
         return match.group(1), match.group(2)
     return None
@@ -473,16 +1236,6 @@ def _sort_outofs(outofs, asst_order):
     return result
 
 
-def _sorted_student_grades(stnum_to_student_grades, key=default_student_sort):
-    student_grades_list = list(stnum_to_student_grades.values())
-
-    def sort_key(record):  # sort by student, according to key
-        return key(record[0])
-
-    student_grades_list.sort(key=sort_key)
-    return student_grades_list
-
-
 def _validate(student_grades, dict_key, outofs, comments):
 
     for key, (student, grades) in student_grades.items():
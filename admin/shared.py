@@ -1,22 +1,91 @@
 '''Shared helpers for various utils. Probably do not use directly.'''
 
+from contextlib import contextmanager
+import os
+import re
 
-def _make_gf_header(outofs=None, utorid=False):
+from .defaults import WRITE_BLOCK_LINES, WRITE_BUFFER_SIZE
+
+# a gf line with student information: student number, two flag
+# characters, last name and first name(s), possibly followed by
+# comma-separated utorid and grades
+GF_STUDENT_LINE = re.compile(r'(\d+) [ dx][ dx] ([^,]+)((\s+([^,]+))+)')
+
+# a gf line with a comment for a student
+GF_COMMENT_LINE = re.compile(r'(\d+)[*]\s+(.+)')
+
+
+def _is_gf_utorid(field):
+    '''Return whether field, the one after the name on a gf student
+    line, is a utorid rather than a grade (e.g., 7 or 7.5).'''
+
+    try:
+        float(field)
+    except ValueError:
+        return True
+    return False
+
+
+class _SortedViews:
+    '''Sorted lists of the values of a dict, one per sort key, kept until
+    the dict changes. The owner of the dict must call invalidate
+    whenever it changes the dict or the sort keys of its values.
+    Only the MAX_VIEWS most recently used sort keys are kept (a new
+    lambda on every call is a new sort key).
+    '''
+
+    MAX_VIEWS = 4
+
+    def __init__(self):
+        self._views = {}
+
+    def invalidate(self):
+        '''Forget all sorted lists.'''
+
+        if self._views:
+            self._views = {}
+
+    def get(self, items, key, value_key=None):
+        '''Return a List of the values of dict items sorted by key(value),
+        or by key(value_key(value)) if value_key is given. Do not modify
+        the returned List: it is reused until invalidate is called.'''
+
+        view = self._views.pop(key, None)
+        if view is None or len(view) != len(items):
+            if value_key is None:
+                view = sorted(items.values(), key=key)
+            else:
+                view = sorted(items.values(),
+                              key=lambda value: key(value_key(value)))
+            if len(self._views) >= self.MAX_VIEWS:
+                del self._views[next(iter(self._views))]
+        self._views[key] = view  # now the most recently used
+        return view
+
+
+def _make_gf_header(outofs=None, utorid=False, formulas=None):
     '''outofs is a List[(asst, grade)], as it must be ordered for gf.
     utorid: should we include a line for utorid?
+    formulas is a Dict[asst, formula] of calculated assignments.
 
     '''
 
     if outofs is None:
         outofs = []
-    header = '*/,\n'
+    if formulas is None:
+        formulas = {}
+    lines = ['*/,\n']
     if utorid:
-        header = header + 'utorid " ! , 9\n'
+        lines.append('utorid " ! , 9\n')
     for asst, outof in outofs:
+        formula = formulas.get(asst)
         # gf does not like spaces, hyphens, and parens in asst names
         asst = asst.replace('(', '_').replace(')', '_').replace(' ', '_').replace('-', '_')
-        header = header + '{} / {}\n'.format(asst, int(outof))
-    return header
+        if formula is not None:
+            lines.append('{} = {}\n'.format(asst, formula))
+        else:
+            lines.append('{} / {}\n'.format(asst, int(outof)))
+    return ''.join(lines)
 
 
 def _make_gf_student_line(student, utorid=False, grades=None, outofs=None, comment=None):
@@ -27,21 +96,77 @@ def _make_gf_student_line(student, utorid=False, grades=None, outofs=None, comme
     If comment is present, write a second line, too: with the comment.
     '''
 
-    line = '{}    {} {}{}'.format(
-        student.student_number,
-        student.last if student.last else '',
-        student.first if student.first else '',
-        ',{}'.format(student.utorid) if utorid else '')
+    return _gf_student_line_maker(utorid, outofs)(student, grades, comment)
+
+
+def _gf_student_line_maker(utorid=False, outofs=None):
+    '''Return a function (student, grades, comment) -> str that makes gf
+    student lines, as _make_gf_student_line does, for these utorid and
+    outofs. Use it to make many lines with the same columns.
+    '''
+
+    assts = [asst for asst, _ in outofs] if outofs else []
+
+    def make_line(student, grades=None, comment=None):
+        parts = [str(student.student_number), '    ',
+                 student.last if student.last else '', ' ',
+                 student.first if student.first else '']
+        if utorid:
+            parts.append(',')
+            parts.append(str(student.utorid))
+        if grades is not None:
+            get_grade = grades.get_grade
+            parts.append(',')
+            # same as str(round(grade, 1)) for any sensible grade, but faster
+            parts.append(','.join(['%.1f' % get_grade(asst)
+                                   for asst in assts]))
+        parts.append('\n')
+        if comment:
+            parts.append('{}* {}\n'.format(student.student_number, comment))
+        return ''.join(parts)
+
+    return make_line
+
+
+def _csv_row_maker(attrs):
+    '''Return a function student -> str that makes the same str as
+    student.full_str(attrs), for many Students.
+    '''
+
+    attrs = tuple(attrs)
+
+    def make_row(student):
+        return ','.join([getattr(student, attr) or '' for attr in attrs])
+
+    return make_row
+
+
+def _write_lines(outfile, lines, block_size=WRITE_BLOCK_LINES):
+    '''Write the strs in iterable lines to outfile, in blocks of
+    block_size strs each.'''
+
+    block = []
+    for line in lines:
+        block.append(line)
+        if len(block) >= block_size:
+            outfile.write(''.join(block))
+            block = []
+    if block:
+        outfile.write(''.join(block))
 
-    if grades:
-        line = (line + ',' +
-                ','.join([str(round(grades.get_grade(asst), 1)) for (asst, grade) in outofs]) +
-                '\n')
 
-    if comment:
-        line += '{}* {}\n'.format(student.student_number, comment)
+@contextmanager
+def _open_for_writing(outfile):
+    '''If outfile is a path, open it for writing with a buffer of
+    WRITE_BUFFER_SIZE; otherwise, it is a file already open for
+    writing and is used as is.'''
 
-    return line
+    if isinstance(outfile, (str, os.PathLike)):
+        with open(outfile, 'w', encoding='utf-8',
+                  buffering=WRITE_BUFFER_SIZE) as opened:
+            yield opened
+    else:
+        yield outfile
 
 
 def _make_csv_header(student_attrs, assts, comments, names=None):
@@ -0,0 +1,191 @@
+'''A compact binary snapshot format, so that unchanged gf and CSV files
+do not have to be parsed (and validated) again on every run.
+
+A snapshot file is:
+  MAGIC, VERSION, kind, byte order, and the size and modification
+    time of the source file the snapshot was made from;
+  a string table: all distinct strings, '\0'-separated;
+  a sequence of sections, each a packed array or raw bytes;
+  a CRC32 of everything before it.
+
+Strings are stored once and referred to by their index in the string
+table (0 is None), so repeated values such as sections are interned.
+Use GradeBook.save_snapshot/load_snapshot and
+Students.save_snapshot/load_snapshot rather than this module directly.
+'''
+
+from array import array
+import os
+import struct
+import sys
+import zlib
+
+MAGIC = b'UTSNAP'
+VERSION = 1
+
+_HEADER = struct.Struct('<6sHc?qq')
+_SECTION = struct.Struct('<cQ')
+_CRC = struct.Struct('<I')
+
+
+class SnapshotWriter:
+    '''Collects strings and sections and writes them to a snapshot file.'''
+
+    def __init__(self, kind, source=None):
+        '''kind is a single byte identifying what is in the snapshot.
+        source is the path of the file this snapshot is made from.'''
+
+        self.kind = kind
+        self.source = source
+        self._strings = {None: 0}
+        self._sections = []
+
+    def intern(self, string):
+        '''Return the index of string (None allowed) in the string table.'''
+
+        index = self._strings.get(string)
+        if index is None:
+            if '\0' in string:
+                raise ValueError('Cannot snapshot {!r}.'.format(string))
+            index = self._strings[string] = len(self._strings)
+        return index
+
+    def add_strings(self, strings):
+        '''Add a section with the indices of strings, an iterable of str or
+        None.'''
+
+        self.add_array(array('I', map(self.intern, strings)))
+
+    def add_array(self, values):
+        '''Add a section with values, an array.array.'''
+
+        self._sections.append((values.typecode.encode(), values.tobytes()))
+
+    def add_bytes(self, data):
+        '''Add a section with raw bytes data.'''
+
+        self._sections.append((b'B', bytes(data)))
+
+    def save(self, path):
+        '''Write the snapshot to path.'''
+
+        size, mtime = source_signature(self.source)
+        strings = sorted(self._strings, key=self._strings.get)[1:]
+        parts = [_HEADER.pack(MAGIC, VERSION, self.kind,
+                              sys.byteorder == 'little', size, mtime)]
+        table = '\0'.join(strings).encode('utf-8')
+        parts.append(struct.pack('<IQ', len(strings), len(table)))
+        parts.append(table)
+        for typecode, data in self._sections:
+            parts.append(_SECTION.pack(typecode, len(data)))
+            parts.append(data)
+        crc = 0
+        for part in parts:
+            crc = zlib.crc32(part, crc)
+        parts.append(_CRC.pack(crc))
+        with open(path, 'wb') as outfile:
+            outfile.write(b''.join(parts))
+
+
+class SnapshotReader:
+    '''Reads back a snapshot file written by SnapshotWriter.'''
+
+    def __init__(self, path, kind, source=None):
+        '''Read the snapshot in path. Raise SnapshotError if it is not a
+        valid snapshot of this kind, or if it is older than source
+        (the path of the file it was made from).
+
+        '''
+
+        try:
+            with open(path, 'rb') as infile:
+                data = infile.read()
+        except OSError as error:
+            raise SnapshotError(path, error.strerror) from error
+
+        if len(data) < _HEADER.size + _CRC.size:
+            raise SnapshotError(path, 'truncated')
+        (crc,) = _CRC.unpack_from(data, len(data) - _CRC.size)
+        if zlib.crc32(memoryview(data)[:-_CRC.size]) != crc:
+            raise SnapshotError(path, 'corrupt')
+
+        magic, version, file_kind, little, size, mtime = \
+            _HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION or file_kind != kind:
+            raise SnapshotError(path, 'wrong format or version')
+        if little != (sys.byteorder == 'little'):
+            raise SnapshotError(path, 'wrong byte order')
+        if source is not None and source_signature(source) != (size, mtime):
+            raise SnapshotError(path, 'stale: {} changed'.format(source))
+
+        offset = _HEADER.size
+        count, length = struct.unpack_from('<IQ', data, offset)
+        offset += struct.calcsize('<IQ')
+        table = data[offset:offset + length].decode('utf-8')
+        self.strings = [None] + (table.split('\0') if count else [])
+        offset += length
+
+        self._data = memoryview(data)
+        self._offset = offset
+        self._end = len(data) - _CRC.size
+
+    def next_array(self, typecode):
+        '''Return the next section, which must be an array of typecode.'''
+
+        section_typecode, data = self._next_section()
+        if section_typecode != typecode.encode():
+            raise SnapshotError('', 'unexpected section')
+        values = array(typecode)
+        values.frombytes(data)
+        return values
+
+    def next_strings(self):
+        '''Return the next section, added with add_strings, as a List of
+        str or None.'''
+
+        strings = self.strings
+        return [strings[index] for index in self.next_array('I')]
+
+    def next_bytes(self):
+        '''Return the next section, which must be raw bytes.'''
+
+        typecode, data = self._next_section()
+        if typecode != b'B':
+            raise SnapshotError('', 'unexpected section')
+        return bytes(data)
+
+    def _next_section(self):
+        if self._offset + _SECTION.size > self._end:
+            raise SnapshotError('', 'missing section')
+        typecode, length = _SECTION.unpack_from(self._data, self._offset)
+        start = self._offset + _SECTION.size
+        self._offset = start + length
+        if self._offset > self._end:
+            raise SnapshotError('', 'truncated section')
+        return typecode, self._data[start:self._offset]
+
+
+def source_signature(source):
+    '''Return (size, modification time in ns) of the file source, or (0, 0)
+    if source is None or does not exist.'''
+
+    if source is None:
+        return (0, 0)
+    try:
+        stat = os.stat(source)
+    except OSError:
+        return (0, 0)
+    return (stat.st_size, stat.st_mtime_ns)
+
+
+class SnapshotError(Exception):
+    '''Exception raised on a missing, stale, or invalid snapshot.
+    '''
+
+    def __init__(self, path, reason):
+        '''path: path of the snapshot
+        reason: what is wrong with it
+        '''
+
+        message = 'Cannot use snapshot {}: {}.'.format(path, reason)
+        Exception.__init__(self, message)
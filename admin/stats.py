@@ -0,0 +1,135 @@
+"""Course statistics and curving on a GradeBook."""
+
+from bisect import bisect_right
+import statistics
+
+
+def summarize(grades):
+    """Return a Dict of summary statistics for an iterable of grades:
+    count, mean, median, stdev (population), min and max. All but
+    count are None if there are no grades.
+
+    """
+
+    grades = list(grades)
+    if not grades:
+        return {'count': 0, 'mean': None, 'median': None, 'stdev': None,
+                'min': None, 'max': None}
+    return {'count': len(grades),
+            'mean': statistics.fmean(grades),
+            'median': statistics.median(grades),
+            'stdev': statistics.pstdev(grades),
+            'min': min(grades),
+            'max': max(grades)}
+
+
+def histogram(grades, bins=10, low=0.0, high=100.0):
+    """Return a List[int] of counts of grades in each of bins equal-width
+    bins between low and high. Grades outside [low, high] are counted
+    in the first or last bin.
+
+    """
+
+    counts = [0] * bins
+    width = (high - low) / bins
+    for grade in grades:
+        counts[min(max(int((grade - low) // width), 0), bins - 1)] += 1
+    return counts
+
+
+def collect_columns(gradebook, assts=None, group_by=None):
+    """Return Dict[group, Dict[asst, List[grade]]] with the grades in
+    gradebook for each of assts, in a single pass over the students.
+
+    group_by is a Student attribute (e.g., 'lecture' or 'tutorial');
+    if None, all students are in a single group None.
+    assts: if None, all assignments in gradebook.
+    """
+
+    assts = list(gradebook.outofs if assts is None else assts)
+    if group_by is None:
+        return {None: {asst: gradebook.get_column(asst) for asst in assts}}
+
+    groups = {}
+    for student, grades in gradebook.studentgrades.values():
+        if grades is None:
+            continue
+        group = groups.get(getattr(student, group_by))
+        if group is None:
+            group = groups[getattr(student, group_by)] = {
+                asst: [] for asst in assts}
+        for asst in assts:
+            try:
+                group[asst].append(grades.get_grade(asst))
+            except KeyError:
+                continue
+    return groups
+
+
+def report(gradebook, assts=None, group_by=None):
+    """Return Dict[group, Dict[asst, stats]], where stats are as in
+    summarize. See collect_columns for assts and group_by.
+
+    """
+
+    return {group: {asst: summarize(grades)
+                    for asst, grades in columns.items()}
+            for group, columns in collect_columns(
+                gradebook, assts, group_by).items()}
+
+
+def linear_curve(slope=1.0, shift=0.0, cap=None):
+    """Return a curve (a function from grade to grade) that maps grade to
+    slope * grade + shift, but not above cap (if given) and not below 0.
+
+    """
+
+    def curve(grade):
+        curved = max(slope * grade + shift, 0.0)
+        return curved if cap is None else min(curved, cap)
+
+    return curve
+
+
+def piecewise_curve(points):
+    """Return a curve (a function from grade to grade) that linearly
+    interpolates between points, a List[(grade, curved_grade)].
+    Grades outside the range of points are mapped like the nearest
+    end point.
+
+    """
+
+    points = sorted(points)
+    xs = [x for x, _ in points]
+
+    def curve(grade):
+        i = bisect_right(xs, grade)
+        if i == 0:
+            return points[0][1]
+        if i == len(points):
+            return points[-1][1]
+        (x0, y0), (x1, y1) = points[i - 1], points[i]
+        return y0 + (y1 - y0) * (grade - x0) / (x1 - x0)
+
+    return curve
+
+
+def add_curved_assignment(gradebook, asst, new_asst, curve, outof=None,
+                          default=0.0):
+    """Add new_asst to gradebook with curve applied to each grade for
+    asst. outof defaults to the outof of asst. Students with no grade
+    for asst (e.g., a calculated one with a missing dependency) get the
+    default grade.
+
+    """
+
+    curved = {}
+    for key, (_, grades) in gradebook.studentgrades.items():
+        if grades is not None:
+            try:
+                curved[key] = curve(grades.get_grade(asst))
+            except KeyError:
+                continue
+    gradebook.add_assignment(
+        new_asst, gradebook.outofs[asst] if outof is None else outof, curved,
+        default)
@@ -0,0 +1,324 @@
+"""A persistent GradeBook and Students store in an SQLite database.
+
+Several scripts (uploaders, manual fixes) can use the same database at
+once: every batch of changes is a single transaction, and the database
+is in WAL mode so readers do not block the writer.
+
+"""
+
+import sqlite3
+
+from .formulas import FormulaEngine
+from .gradebook import (GradeBook, Grades, _clean_asst, _clean_grade,
+                        _formula_outof)
+from .students import Student, Students, STUDENT_ATTRS
+
+# attributes by which students are matched and looked up
+INDEXED_BY = ('student_number', 'utorid', 'gitid')
+
+_COLUMNS = ', '.join('"{}"'.format(attr) for attr in STUDENT_ATTRS)
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS students (
+    id INTEGER PRIMARY KEY,
+    {columns});
+CREATE UNIQUE INDEX IF NOT EXISTS students_student_number
+    ON students(student_number);
+CREATE UNIQUE INDEX IF NOT EXISTS students_utorid ON students(utorid);
+CREATE INDEX IF NOT EXISTS students_gitid ON students(gitid);
+CREATE TABLE IF NOT EXISTS assignments (
+    name TEXT PRIMARY KEY,
+    outof REAL NOT NULL,
+    formula TEXT,
+    position INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS grades (
+    student_id INTEGER NOT NULL REFERENCES students(id) ON DELETE CASCADE,
+    asst TEXT NOT NULL REFERENCES assignments(name) ON DELETE CASCADE,
+    grade REAL NOT NULL,
+    PRIMARY KEY (student_id, asst)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS grades_by_asst ON grades(asst, grade);
+CREATE TABLE IF NOT EXISTS comments (
+    student_id INTEGER PRIMARY KEY REFERENCES students(id) ON DELETE CASCADE,
+    comment TEXT NOT NULL);
+'''.format(columns=', '.join('"{}" TEXT'.format(attr)
+                             for attr in STUDENT_ATTRS))
+
+
+class GradeStore:
+    """Students and their grades in an SQLite database."""
+
+    def __init__(self, path, timeout=30.0):
+        """Open (creating if needed) the database in file path. timeout is
+        how many seconds to wait for another script's transaction.
+
+        """
+
+        self.connection = sqlite3.connect(path, timeout=timeout)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('PRAGMA foreign_keys=ON')
+        self.connection.executescript(_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Close the database."""
+
+        self.connection.close()
+
+    def save_students(self, students):
+        """Add or update students (an iterable of Student) in one
+        transaction. A Student is matched to a stored one by any of
+        INDEXED_BY; attributes that are None do not overwrite stored
+        ones. A Student that matches several stored ones (e.g., one by
+        student_number and another by utorid) is a conflict: it is not
+        saved, and a warning is printed. Return a Dict[id(Student),
+        database id] of the saved Students.
+
+        """
+
+        with self.connection:
+            return self._save_students(students)
+
+    def save_gradebook(self, gradebook):
+        """Add or update all students, assignments, grades and comments in
+        gradebook, in one transaction. Conflicting students are skipped,
+        as in save_students.
+
+        """
+
+        with self.connection:
+            self._save_assignments(gradebook.outofs, gradebook.formulas)
+            records = list(gradebook.studentgrades.items())
+            ids = self._save_students(student for _, (student, _) in records)
+            self.connection.executemany(
+                'INSERT INTO grades VALUES (?, ?, ?) '
+                'ON CONFLICT(student_id, asst) DO UPDATE SET grade = excluded.grade',
+                ((ids[id(student)], asst, grade)
+                 for _, (student, grades) in records
+                 if grades is not None and id(student) in ids
+                 for asst, grade in grades.grades.items()))
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO comments VALUES (?, ?)',
+                ((ids[id(student)], gradebook.comments[key])
+                 for key, (student, _) in records
+                 if gradebook.comments.get(key) and id(student) in ids))
+
+    def upsert_grades(self, asst, attr_to_grade, attribute='utorid',
+                      outof=None):
+        """Add or update grades for asst in one transaction.
+
+        attr_to_grade is a Dict[attr_value, grade], where attr_value is
+          the value of attribute (one of INDEXED_BY) of a stored Student.
+        outof: if not None, add or update asst with this outof (keeping
+          its formula, if any). asst must exist already otherwise.
+        Calculated assignments that depend on asst are recomputed for
+        these Students in the same transaction.
+        Return the List of attr_values with no such stored Student.
+        """
+
+        _check_attribute(attribute)
+        asst = _clean_asst(asst)
+        with self.connection:
+            if outof is not None:
+                self._save_assignments({asst: outof})
+            ids = self._ids_by(attribute, attr_to_grade)
+            self.connection.executemany(
+                'INSERT INTO grades VALUES (?, ?, ?) '
+                'ON CONFLICT(student_id, asst) DO UPDATE SET grade = excluded.grade',
+                ((ids[attr_value], asst, _clean_grade(grade))
+                 for attr_value, grade in attr_to_grade.items()
+                 if attr_value in ids))
+            self._recompute(asst, list(ids.values()), outof is not None)
+        return [attr_value for attr_value in attr_to_grade
+                if attr_value not in ids]
+
+    def load_students(self, dict_key='student_number'):
+        """Return all stored students as Students."""
+
+        return Students(
+            (Student._make_unchecked(row) for row in self.connection.execute(
+                'SELECT {} FROM students'.format(_COLUMNS))),
+            dict_key)
+
+    def load_gradebook(self, dict_key='student_number', columnar=False):
+        """Return a GradeBook with all stored students, assignments, grades
+        and comments.
+
+        """
+
+        outofs = {}
+        formulas = {}
+        for name, outof, formula in self.connection.execute(
+                'SELECT name, outof, formula FROM assignments '
+                'ORDER BY position'):
+            outofs[name] = outof
+            if formula is not None:
+                formulas[name] = formula
+
+        students = {}
+        for row in self.connection.execute(
+                'SELECT id, {} FROM students'.format(_COLUMNS)):
+            students[row[0]] = (Student._make_unchecked(row[1:]), Grades())
+        for student_id, asst, grade in self.connection.execute(
+                'SELECT student_id, asst, grade FROM grades'):
+            students[student_id][1].grades[asst] = grade
+
+        gradebook = GradeBook(None, dict_key, outofs, formulas=formulas,
+                              sanity_check=False)
+        comments = dict(self.connection.execute(
+            'SELECT student_id, comment FROM comments'))
+        for student_id, (student, grades) in students.items():
+            gradebook.add_student_grades(student, grades,
+                                         comments.get(student_id))
+        if columnar:
+            gradebook.to_columnar()
+        return gradebook
+
+    def get_grades(self, asst, attribute='utorid'):
+        """Return a Dict[attr_value, grade] of all grades for asst, keyed by
+        the values of attribute (one of INDEXED_BY) of the Students.
+
+        """
+
+        return self.grades_between(asst, None, None, attribute)
+
+    def grades_below(self, asst, threshold, attribute='utorid'):
+        """Return a Dict[attr_value, grade] of grades for asst that are
+        below threshold. See get_grades.
+
+        """
+
+        return self.grades_between(asst, None, threshold, attribute, False)
+
+    def grades_between(self, asst, low=None, high=None, attribute='utorid',
+                       inclusive=True):
+        """Return a Dict[attr_value, grade] of grades for asst with
+        low <= grade <= high (or low <= grade < high if not inclusive).
+        low and high may be None for no bound. See get_grades.
+
+        """
+
+        _check_attribute(attribute)
+        query = ('SELECT students."{}", grade FROM grades '
+                 'JOIN students ON students.id = grades.student_id '
+                 'WHERE asst = ?'.format(attribute))
+        params = [asst]
+        if low is not None:
+            query += ' AND grade >= ?'
+            params.append(low)
+        if high is not None:
+            query += ' AND grade {} ?'.format('<=' if inclusive else '<')
+            params.append(high)
+        return dict(self.connection.execute(query, params))
+
+    def _save_assignments(self, outofs, formulas=None):
+        """Add or update assignments with outofs. If formulas is None, the
+        formulas of existing assignments are kept; otherwise, they are
+        replaced with formulas (NULL if not in formulas)."""
+
+        (position,) = self.connection.execute(
+            'SELECT COUNT(*) FROM assignments').fetchone()
+        update = ('outof = excluded.outof' if formulas is None else
+                  'outof = excluded.outof, formula = excluded.formula')
+        formulas = formulas or {}
+        for asst, outof in outofs.items():
+            self.connection.execute(
+                'INSERT INTO assignments VALUES (?, ?, ?, ?) '
+                'ON CONFLICT(name) DO UPDATE SET ' + update,
+                (asst, outof, formulas.get(asst), position))
+            position += 1
+
+    def _recompute(self, asst, student_ids, outof_changed=False):
+        """Recompute the calculated assignments that depend on asst for the
+        stored Students with student_ids, and their outofs too if
+        outof_changed.
+
+        """
+
+        formulas = dict(self.connection.execute(
+            'SELECT name, formula FROM assignments '
+            'WHERE formula IS NOT NULL'))
+        engine = FormulaEngine(formulas)
+        names = engine.affected([asst])
+        if not names:
+            return
+
+        if outof_changed:
+            outofs = dict(self.connection.execute(
+                'SELECT name, outof FROM assignments'))
+            self.connection.executemany(
+                'UPDATE assignments SET outof = ? WHERE name = ?',
+                ((_formula_outof(engine, name, outofs), name)
+                 for name in names))
+
+        id_to_grades = {student_id: Grades() for student_id in student_ids}
+        for start in range(0, len(student_ids), 500):
+            chunk = student_ids[start:start + 500]
+            for student_id, name, grade in self.connection.execute(
+                    'SELECT student_id, asst, grade FROM grades '
+                    'WHERE student_id IN ({})'.format(
+                        ', '.join('?' * len(chunk))), chunk):
+                id_to_grades[student_id].grades[name] = grade
+        engine.recompute_grades(list(id_to_grades.values()), [asst])
+
+        self.connection.executemany(
+            'INSERT INTO grades VALUES (?, ?, ?) '
+            'ON CONFLICT(student_id, asst) DO UPDATE SET grade = excluded.grade',
+            ((student_id, name, grades.grades[name])
+             for student_id, grades in id_to_grades.items()
+             for name in names if name in grades.grades))
+        self.connection.executemany(
+            'DELETE FROM grades WHERE student_id = ? AND asst = ?',
+            ((student_id, name)
+             for student_id, grades in id_to_grades.items()
+             for name in names if name not in grades.grades))
+
+    def _save_students(self, students):
+        ids = {}
+        select = 'SELECT id FROM students WHERE {}'.format(
+            ' OR '.join('"{}" = ?'.format(attr) for attr in INDEXED_BY))
+        update = 'UPDATE students SET {} WHERE id = ?'.format(', '.join(
+            '"{0}" = COALESCE(?, "{0}")'.format(attr)
+            for attr in STUDENT_ATTRS))
+        insert = 'INSERT INTO students ({}) VALUES ({})'.format(
+            _COLUMNS, ', '.join('?' * len(STUDENT_ATTRS)))
+        for student in students:
+            values = [getattr(student, attr) for attr in STUDENT_ATTRS]
+            rows = self.connection.execute(
+                select, [getattr(student, attr) for attr in INDEXED_BY]
+            ).fetchall()
+            if not rows:
+                ids[id(student)] = self.connection.execute(
+                    insert, values).lastrowid
+            elif len(rows) > 1:
+                print('WARNING: Not saving Student that matches {} stored '
+                      'Students:\n\t{}'.format(len(rows), student))
+            else:
+                self.connection.execute(update, values + [rows[0][0]])
+                ids[id(student)] = rows[0][0]
+        return ids
+
+    def _ids_by(self, attribute, attr_values):
+        """Return a Dict[attr_value, database id] for stored Students whose
+        attribute is one of attr_values."""
+
+        attr_values = list(attr_values)
+        ids = {}
+        # stay well below SQLite's limit on the number of parameters
+        for start in range(0, len(attr_values), 500):
+            chunk = attr_values[start:start + 500]
+            ids.update(self.connection.execute(
+                'SELECT "{}", id FROM students WHERE "{}" IN ({})'.format(
+                    attribute, attribute, ', '.join('?' * len(chunk))),
+                chunk))
+        return ids
+
+
+def _check_attribute(attribute):
+    if attribute not in INDEXED_BY:
+        raise ValueError('Cannot look up students by {}.'.format(attribute))
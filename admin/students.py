@@ -1,20 +1,48 @@
 '''Representations of a single Student and a bunch of Students.'''
 
 
+from collections import namedtuple
 import csv
 import json
-import re
+import sys
 from email_validator import validate_email, EmailNotValidError
 
 
 from .defaults import (DEFAULT_STUDENT_STR, default_student_sort,
                        DEFAULT_CATME_STR, MAX_UTORID_LENGTH,
                        STUDENT_NUMBER_LENGTH)
-from .shared import _make_gf_header, _make_gf_student_line
+from .snapshot import SnapshotReader, SnapshotWriter, SnapshotError
+from .shared import (GF_STUDENT_LINE, _make_gf_header, _gf_student_line_maker,
+                     _csv_row_maker, _is_gf_utorid, _open_for_writing,
+                     _write_lines, _SortedViews)
 
 # two Student's are equal if they match on any of these attributes
 EQ_STUDENTS = ('student_number', 'utorid', 'gitid')
 
+# all attributes of a Student
+STUDENT_ATTRS = ('utorid', 'student_number', 'email', 'first', 'last',
+                 'lecture', 'tutorial', 'gitid', 'team', 'id1', 'id2')
+
+# attributes of a Student that place it in a section
+SECTION_ATTRS = ('lecture', 'tutorial')
+
+# values of these attributes repeat across many Students, so they are
+# interned: all Students in a section share one str
+INTERNED_ATTRS = ('lecture', 'tutorial', 'team')
+
+# how emails are validated when Students are loaded:
+# full: syntax, and that the domain accepts email (a DNS lookup per domain);
+# syntax: syntax only, offline;
+# None: not at all (call Students.check_emails afterwards)
+EMAIL_CHECKS = ('full', 'syntax', None)
+
+# columns of an Intranet classlist, as rearranged by load_intranet_classlist
+_INTRANET_ATTRS = ('student_number', 'email', 'first', 'last', 'lecture',
+                   'tutorial')
+
+# kind of snapshot files of Students
+SNAPSHOT_KIND = b'S'
+
 
 class Students:
     '''Students hashed by some dict_key.'''
@@ -28,47 +56,247 @@ class Students:
         else:
             self.students = {}
         self.dict_key = dict_key
+        self._sorted_views = _SortedViews()
+        self._reindex()
 
     def add_student(self, student):
         '''Add new student.'''
 
-        self.students[getattr(student, self.dict_key)] = student
+        key = getattr(student, self.dict_key)
+        old_student = self.students.get(key)
+        if old_student is not None:
+            self._unindex_student(old_student)
+        self.students[key] = student
+        self._index_student(student)
+        self._sorted_views.invalidate()
+
+    def find(self, any_id):
+        '''Return the Student with any of EQ_STUDENTS equal to any_id, or
+        None if there is no such Student.'''
+
+        for attribute in EQ_STUDENTS:
+            student = self._lookup(attribute, any_id)
+            if student is not None:
+                return student
+        return None
+
+    def match(self, student):
+        '''Return the Student equal to student (i.e., matching on any of
+        EQ_STUDENTS) in these Students, or None if there is none.'''
+
+        for attribute in EQ_STUDENTS:
+            attr_value = getattr(student, attribute)
+            if attr_value:
+                match = self._lookup(attribute, attr_value)
+                if match is not None:
+                    return match
+        return None
+
+    def _reindex(self):
+        """Rebuild the EQ_STUDENTS indexes from scratch."""
+
+        self._index = {attribute: {} for attribute in EQ_STUDENTS}
+        for student in self.students.values():
+            self._index_student(student)
+
+    def _index_student(self, student):
+        for attribute, index in self._index.items():
+            attr_value = getattr(student, attribute)
+            if attr_value:
+                index[attr_value] = student
+
+    def _unindex_student(self, student):
+        for attribute, index in self._index.items():
+            attr_value = getattr(student, attribute)
+            if attr_value and index.get(attr_value) is student:
+                del index[attr_value]
+
+    def _lookup(self, attribute, attr_value):
+        """Return the Student whose attribute (one of EQ_STUDENTS) is
+        attr_value, or None if there is no such Student.
+
+        """
+
+        student = self._index[attribute].get(attr_value)
+        if student is None:
+            return None
+        if (getattr(student, attribute) != attr_value or
+                self.students.get(getattr(student, self.dict_key))
+                is not student):
+            # students was modified behind our back
+            self._reindex()
+            return self._index[attribute].get(attr_value)
+        return student
+
+    def sorted_students(self, key=default_student_sort):
+        '''Return a List[Student] of these Students sorted by key. The List
+        is cached until a Student is added, so do not modify it; call
+        invalidate_sorted after changing Students' attributes in place.
+
+        '''
+
+        return self._sorted_views.get(self.students, key)
+
+    def invalidate_sorted(self):
+        '''Forget cached sorted_students, e.g., after renaming a Student.'''
+
+        self._sorted_views.invalidate()
 
     @staticmethod
-    def load_intranet_classlist(infile, dict_key='student_number'):
+    def load_intranet_classlist(infile, dict_key='student_number',
+                                check_emails='full'):
         '''Return a new Students created from an Intranet classlist csv file.
+        check_emails is one of EMAIL_CHECKS.
 
         '''
 
-        reader = csv.DictReader(infile)
-        students = Students(None, dict_key)
-        for row in reader:
-            names = row['My Students (Lname, Fname)'].split(',')
-            student = Student(student_number=row['StudentID'],
-                              email=row['Email'],
-                              first=names[1],
-                              last=names[0],
-                              lecture=row['Lecture'],
-                              tutorial=row['Tutorial']
-                              )
-            students.add_student(student)
-        return students
+        return Students(Student.make_students(
+            _intranet_rows(infile), _INTRANET_ATTRS, check_emails), dict_key)
 
     @staticmethod
     def load_classlist(infile, attrs=DEFAULT_STUDENT_STR,
-                       dict_key='student_number'):
+                       dict_key='student_number', check_emails='full'):
         '''Return a new Students created from a classlist csv file.  attrs
-        correspond to the columns in the classlist file.
+        correspond to the columns in the classlist file. check_emails is
+        one of EMAIL_CHECKS.
 
         '''
 
         reader = csv.reader(infile)
-        students = Students(None, dict_key)
-        for row in reader:
-            student = Student(**dict(zip(attrs, row)))
-            students.add_student(student)
+        return Students(Student.make_students(reader, attrs, check_emails),
+                        dict_key)
+
+    @staticmethod
+    def iter_classlist(infile, projection, attrs=DEFAULT_STUDENT_STR,
+                       check_emails='full'):
+        '''Yield a namedtuple with the attributes in projection (a Sequence
+        of attrs) for each row of a classlist csv file, without making
+        Students. attrs correspond to the columns in the classlist file.
+        Only the attributes in projection are cleaned and validated, as
+        in Student(); check_emails is one of EMAIL_CHECKS.
+
+        '''
+
+        return _iter_projected(csv.reader(infile), attrs, projection,
+                               check_emails)
+
+    @staticmethod
+    def iter_intranet_classlist(infile, projection, check_emails='full'):
+        '''Yield a namedtuple with the attributes in projection for each
+        student in an Intranet classlist csv file, as in iter_classlist.
+
+        '''
+
+        return _iter_projected(_intranet_rows(infile), _INTRANET_ATTRS,
+                               projection, check_emails)
+
+    def save_snapshot(self, path, source=None):
+        '''Save these Students to a binary snapshot file path. source is
+        the path of the classlist file they were loaded from, if any:
+        the snapshot is stale once source changes.
+
+        '''
+
+        writer = SnapshotWriter(SNAPSHOT_KIND, source)
+        _write_student_columns(writer, list(self.students.values()))
+        writer.save(path)
+
+    @staticmethod
+    def load_snapshot(path, source=None, attrs=DEFAULT_STUDENT_STR,
+                      dict_key='student_number', check_emails='full'):
+        '''Return a new Students loaded from the snapshot file path. If the
+        snapshot is missing, stale, or corrupt, load the classlist csv
+        file source instead (as in load_classlist, with attrs and
+        check_emails) and save a fresh snapshot. Raise SnapshotError if
+        that is not possible because source is None.
+
+        '''
+
+        try:
+            reader = SnapshotReader(path, SNAPSHOT_KIND, source)
+            return Students(_read_student_columns(reader), dict_key)
+        except SnapshotError as error:
+            if source is None:
+                raise
+            print('WARNING: {} Loading {}.'.format(error, source))
+
+        with open(source, encoding='utf-8') as infile:
+            students = Students.load_classlist(infile, attrs, dict_key,
+                                               check_emails)
+        students.save_snapshot(path, source)
         return students
 
+    def check_emails(self, check_emails='full'):
+        '''Validate the emails of all these Students in one pass, e.g.,
+        after loading them with check_emails=None. check_emails is one
+        of EMAIL_CHECKS. Return a List[Student] with an invalid email.
+
+        '''
+
+        is_email = _email_checker(check_emails)
+        if is_email is None:
+            return []
+        return [student for student in self.students.values()
+                if student.email is not None and not is_email(student.email)]
+
+    @staticmethod
+    def resolve(sources, dict_key='student_number'):
+        '''Merge the records of the same students from several sources
+        (e.g., an Intranet classlist, a Canvas roster, MarkUs groups,
+        GitHub usernames) into canonical Students.
+
+        sources is an iterable of iterables of Student (e.g., Students).
+        Two records are of the same student if they share any of
+        EQ_STUDENTS, directly or through other records. The canonical
+        Student has, for each attribute, the first value that is not
+        None, in the order of sources.
+
+        Return (Students, conflicts), where conflicts is a
+        List[(Student, attribute, List[values])] of the canonical
+        Students whose records disagree on attribute, with all the
+        values found, in order.
+
+        '''
+
+        records = [student for source in sources for student in source]
+        groups = _DisjointSets(len(records))
+        first_with = {attribute: {} for attribute in EQ_STUDENTS}
+        for i, student in enumerate(records):
+            for attribute, first in first_with.items():
+                attr_value = getattr(student, attribute)
+                if attr_value:
+                    groups.union(first.setdefault(attr_value, i), i)
+
+        members = {}
+        for i in range(len(records)):
+            members.setdefault(groups.find(i), []).append(records[i])
+
+        students = Students(None, dict_key)
+        conflicts = []
+        for group in members.values():
+            values = []
+            group_conflicts = []
+            for attribute in STUDENT_ATTRS:
+                attr_values = []
+                for student in group:
+                    attr_value = getattr(student, attribute)
+                    if (attr_value is not None and
+                            attr_value not in attr_values):
+                        attr_values.append(attr_value)
+                values.append(attr_values[0] if attr_values else None)
+                if len(attr_values) > 1:
+                    group_conflicts.append((attribute, attr_values))
+            student = Student._make_unchecked(values)
+            conflicts.extend((student, attribute, attr_values)
+                             for attribute, attr_values in group_conflicts)
+            if getattr(student, dict_key) is None:
+                print('WARNING: '
+                      'Student does not have attribute {}:\n\t{}'.format(
+                          dict_key, student))
+            else:
+                students.add_student(student)
+        return students, conflicts
+
     def _update_emails(self, updatefrom):
         """Only here to address the Quercus no-emails bug.
 
@@ -79,6 +307,7 @@ class Students:
 
         """
 
+        self._sorted_views.invalidate()
         for key, student in self.students.items():
             try:
                 if (student.email is None or
@@ -93,24 +322,25 @@ class Students:
                         key=default_student_sort):
         '''Write out a CSV classlist to outfile.
 
-        outfile is the file to write to, open for writing.
+        outfile is the file to write to, open for writing, or a path.
         attrs is an iterable of attributes of Student to include.
         key is the key for sorting Students.
         header is True/False: whether to write the header
         '''
 
-        student_list = list(self.students.values())
-        student_list.sort(key=key)
-        if header:
-            outfile.write(','.join(list(attrs)) + '\n')
-        for student in student_list:
-            outfile.write(student.full_str(attrs) + '\n')
+        student_list = self.sorted_students(key)
+        make_row = _csv_row_maker(attrs)
+        with _open_for_writing(outfile) as out:
+            if header:
+                out.write(','.join(list(attrs)) + '\n')
+            _write_lines(out, (make_row(student) + '\n'
+                               for student in student_list))
 
     def write_gf(self, outfile, outofs=None, utorid=True,
                  key=default_student_sort):
         '''Write out an empty gf file.
 
-        outfile is the file to write to, open for writing.
+        outfile is the file to write to, open for writing, or a path.
         outofs is a Dict[asst:str, outof:int] for the header.
         key is the key for sorting Students.
         utorid is True/False: whether to include utorids.
@@ -119,66 +349,63 @@ class Students:
         if outofs is None:
             outofs = {}
 
-        student_list = list(self.students.values())
-        student_list.sort(key=key)
-
-        header = _make_gf_header(outofs, utorid)
-        outfile.write(header + '\n')
+        student_list = self.sorted_students(key)
 
-        for student in student_list:
-            line = _make_gf_student_line(student, utorid)
-            outfile.write(line)
+        header = _make_gf_header(list(outofs.items()), utorid)
+        make_line = _gf_student_line_maker(utorid)
+        with _open_for_writing(outfile) as out:
+            out.write(header + '\n')
+            _write_lines(out, (make_line(student)
+                               for student in student_list))
 
     def write_catme(self, outfile, attrs=DEFAULT_CATME_STR,
                     header=True, key=default_student_sort):
         '''Write out a CATME student file to outfile.
 
-        outfile is the file to write to, open for writing.
+        outfile is the file to write to, open for writing, or a path.
         attrs is an iterable of attributes of Student to include.
         key is the key for sorting Students.
         header is True/False: whether to write the header
         '''
 
-        if header:
-            outfile.write('first,last,email,id,team\n')
-
-        student_list = list(self.students.values())
-        student_list.sort(key=key)
-        for student in student_list:
-            outfile.write(student.full_str(attrs) + '\n')
+        student_list = self.sorted_students(key)
+        make_row = _csv_row_maker(attrs)
+        with _open_for_writing(outfile) as out:
+            if header:
+                out.write('first,last,email,id,team\n')
+            _write_lines(out, (make_row(student) + '\n'
+                               for student in student_list))
 
     def by_utorid(self):
-        '''Return a Dict[utorid, Student]. Raises AttributeError if there is a
-        Student with no utorid.'''
+        '''Return a Dict[utorid, Student], leaving out (with a warning)
+        Students with no utorid.'''
 
         return self._by_field('utorid')
 
     def by_student_number(self):
-        '''Return a Dict[student_number, Student]. Raises AttributeError if there is a
-        Student with no student_number.'''
+        '''Return a Dict[student_number, Student], leaving out (with a warning)
+        Students with no student_number.'''
 
         return self._by_field('student_number')
 
     def by_gitid(self):
-        '''Return a Dict[gitid, Student]. Raises AttributeError if there is a
-        Student with no gitid.'''
+        '''Return a Dict[gitid, Student], leaving out (with a warning)
+        Students with no gitid.'''
 
         return self._by_field('gitid')
 
     def _by_field(self, attribute):
-        '''Return a Dict[attribute, Student].  Raises AttributeError if there
-        is no such attribute in one (or more) Student.
+        '''Return a Dict[attribute, Student], a copy of the index on
+        attribute (one of EQ_STUDENTS).
 
         '''
 
-        attr2student = {}
-        for student in self.students.values():
-            attr = getattr(student, attribute)
-            if attr is not None:
-                attr2student[attr] = student
-            else:
-                print('WARNING: Student\'s attribute {} is None!\n\t{}'.format(
-                    attribute, student))
+        attr2student = dict(self._index[attribute])
+        if len(attr2student) < len(self.students):
+            for student in self.students.values():
+                if getattr(student, attribute) is None:
+                    print('WARNING: Student\'s attribute {} is None!\n\t{}'
+                          .format(attribute, student))
         return attr2student
 
     def to_json(self):
@@ -193,8 +420,7 @@ class Students:
         key is the key for sorting Students.
         '''
 
-        student_list = list(self.students.values())
-        student_list.sort(key=key)
+        student_list = self.sorted_students(key)
         return ('{' + str([student.full_str(ordering)
                            for student in student_list])[1:-1] + '}')
 
@@ -210,6 +436,12 @@ class Students:
 
         return self.full_str(DEFAULT_STUDENT_STR, default_student_sort)
 
+    def __contains__(self, student):
+        '''Return whether a Student equal to student (i.e., matching on any
+        of EQ_STUDENTS) is in these Students.'''
+
+        return self.match(student) is not None
+
     def __eq__(self, other):
         return (len(self) == len(other) and
                 all(student in other for student in self.students.values()))
@@ -220,38 +452,61 @@ class Student:
     """A representation of a student.
     """
 
+    __slots__ = STUDENT_ATTRS
+
     def __init__(self, **kwargs):
         """Instantiate this Student from given fields.
         """
 
-        self.utorid = _clean(kwargs.get('utorid'))
-        if self.utorid is not None and not _is_utorid(self.utorid):
-            raise InvalidStudentInfoError('UTORID', self.utorid)
+        for attr in STUDENT_ATTRS:
+            value = _clean(kwargs.get(attr))
+            if value is not None and attr in _CHECKS:
+                value = _CHECKS[attr](value)
+            setattr(self, attr, value)
 
-        self.student_number = _clean(kwargs.get('student_number'))
-        if self.student_number is not None:
-            if _is_student_number(self.student_number):
-                self.student_number = self.student_number.zfill(10)
-            else:
-                raise InvalidStudentInfoError(
-                    'student number', self.student_number)
-
-        self.email = _clean(kwargs.get('email'))
-        if self.email is not None and not _is_email(self.email):
-            raise InvalidStudentInfoError('email', self.email)
-
-        self.first = _clean(kwargs.get('first'))
-        self.last = _clean(kwargs.get('last'))
-        self.lecture = _clean(kwargs.get('lecture'))
-        self.tutorial = _clean(kwargs.get('tutorial'))
-        self.gitid = _clean(kwargs.get('gitid'))
-        self.team = _clean(kwargs.get('team'))
-        self.id1 = _clean(kwargs.get('id1'))
-        self.id2 = _clean(kwargs.get('id2'))
+    @staticmethod
+    def make_students(rows, attrs=DEFAULT_STUDENT_STR, check_emails='full'):
+        '''Return a List[Student] made from rows, an iterable of Sequences
+        of attribute values in the order of attrs (e.g., rows of a
+        classlist). Values are cleaned and validated as in Student(),
+        but without building a dict of keyword arguments per Student,
+        and emails are validated according to check_emails, one of
+        EMAIL_CHECKS. Attributes not in STUDENT_ATTRS are ignored.
+
+        '''
+
+        checks = _checks(check_emails)
+        columns = [(i, attr, checks.get(attr))
+                   for i, attr in enumerate(attrs) if attr in STUDENT_ATTRS]
+        missing = [attr for attr in STUDENT_ATTRS if attr not in attrs]
+        students = []
+        for row in rows:
+            student = Student.__new__(Student)
+            for attr in missing:
+                setattr(student, attr, None)
+            for i, attr, check in columns:
+                value = _clean(row[i]) if i < len(row) else None
+                if value is not None and check is not None:
+                    value = check(value)
+                setattr(student, attr, value)
+            students.append(student)
+        return students
+
+    @staticmethod
+    def _make_unchecked(values):
+        '''Create a Student from values, a Sequence of attribute values in
+        the order of STUDENT_ATTRS, that are known to be clean and
+        valid (e.g., because they come from a Student).'''
+
+        student = Student.__new__(Student)
+        for attr, value in zip(STUDENT_ATTRS, values):
+            setattr(student, attr, value)
+        return student
 
     def to_json(self):
         '''Return a JSON for this Student: all attributes.'''
-        return json.dumps(self, default=lambda o: o.__dict__,
+        return json.dumps(self, default=lambda o: {
+            attr: getattr(o, attr) for attr in STUDENT_ATTRS},
                           sort_keys=True, indent=4)
 
     def __str__(self):
@@ -278,20 +533,26 @@ class Student:
         that does not contain student information.'''
 
         fields = line.strip().split(',')
-        match = re.fullmatch(
-            r'(\d+) [ dx][ dx] ([^,]+)((\s+([^,]+))+)', fields[0])
+        match = GF_STUDENT_LINE.fullmatch(fields[0])
 
         # this is not a gf line with student information (e.g., a comment line)
         if match is None:
             return None
 
+        return Student._make_student_from_gf_fields(match, fields, use_utorid)
+
+    @staticmethod
+    def _make_student_from_gf_fields(match, fields, use_utorid=True):
+        '''Create a Student from a gf line already split into fields, the
+        first of which matched GF_STUDENT_LINE as match.'''
+
         stunum = match.group(1)
         last = match.group(2)
         first = match.group(3).strip()
 
         if use_utorid:
             utorid = fields[1] if len(
-                fields) > 1 and not fields[1].isdigit() else None
+                fields) > 1 and _is_gf_utorid(fields[1]) else None
         else:
             utorid = None
 
@@ -313,10 +574,131 @@ class InvalidStudentInfoError(Exception):
         Exception.__init__(self, message)
 
 
+def _intranet_rows(infile):
+    '''Yield the values of _INTRANET_ATTRS for each student in an Intranet
+    classlist csv file.'''
+
+    for row in csv.DictReader(infile):
+        names = row['My Students (Lname, Fname)'].split(',')
+        yield (row['StudentID'], row['Email'], names[1], names[0],
+               row['Lecture'], row['Tutorial'])
+
+
+def _iter_projected(rows, attrs, projection, check_emails):
+    '''Return an Iterator of a StudentRow with the attributes in
+    projection for each of rows, Sequences of values in the order of
+    attrs. Raise ValueError on an invalid projection.'''
+
+    for attr in projection:
+        if attr not in attrs or attr not in STUDENT_ATTRS:
+            raise ValueError('Cannot project on {}.'.format(attr))
+    make_row = _student_row_type(tuple(projection))._make
+    checks = _checks(check_emails)
+    columns = [(attrs.index(attr), checks.get(attr)) for attr in projection]
+    return _project_rows(rows, make_row, columns)
+
+
+def _project_rows(rows, make_row, columns):
+    for row in rows:
+        values = []
+        for i, check in columns:
+            value = _clean(row[i]) if i < len(row) else None
+            if value is not None and check is not None:
+                value = check(value)
+            values.append(value)
+        yield make_row(values)
+
+
+_student_row_types = {}
+
+
+def _student_row_type(projection):
+    '''Return the namedtuple type StudentRow with fields projection.'''
+
+    row_type = _student_row_types.get(projection)
+    if row_type is None:
+        row_type = _student_row_types[projection] = namedtuple(
+            'StudentRow', projection)
+    return row_type
+
+
+class _DisjointSets:
+    '''Union-find over the integers 0..size-1, with path halving and union
+    by size.'''
+
+    def __init__(self, size):
+        self.parent = list(range(size))
+        self.size = [1] * size
+
+    def find(self, i):
+        '''Return the representative of the set of i.'''
+
+        parent = self.parent
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(self, i, j):
+        '''Merge the sets of i and j.'''
+
+        i, j = self.find(i), self.find(j)
+        if i == j:
+            return
+        if self.size[i] < self.size[j]:
+            i, j = j, i
+        self.parent[j] = i
+        self.size[i] += self.size[j]
+
+
+def _write_student_columns(writer, student_list):
+    '''Add the attributes of each Student in student_list to the
+    SnapshotWriter writer, one section per attribute.'''
+
+    for attr in STUDENT_ATTRS:
+        writer.add_strings([getattr(student, attr) for student in student_list])
+
+
+def _read_student_columns(reader):
+    '''Return a List[Student] read from the SnapshotReader reader, as
+    written by _write_student_columns.'''
+
+    columns = [reader.next_strings() for _ in STUDENT_ATTRS]
+    return [Student._make_unchecked(values) for values in zip(*columns)]
+
+
 def _clean(word):
     return word.strip() if word else word
 
 
+def _check_utorid(word):
+    if not _is_utorid(word):
+        raise InvalidStudentInfoError('UTORID', word)
+    return word
+
+
+def _check_student_number(word):
+    if not _is_student_number(word):
+        raise InvalidStudentInfoError('student number', word)
+    return word.zfill(STUDENT_NUMBER_LENGTH)
+
+
+def _email_check(check_emails):
+    '''Return a function that validates an email according to
+    check_emails, one of EMAIL_CHECKS, or None for no validation.'''
+
+    is_email = _email_checker(check_emails)
+    if is_email is None:
+        return None
+
+    def check_email(word):
+        if not is_email(word):
+            raise InvalidStudentInfoError('email', word)
+        return word
+
+    return check_email
+
+
 def _is_utorid(word):
     '''Alphanumeric up to MAX_UTORID_LENGTH.'''
 
@@ -328,9 +710,66 @@ def _is_student_number(word):
             STUDENT_NUMBER_LENGTH - 1 <= len(word) <= STUDENT_NUMBER_LENGTH)
 
 
+class _EmailChecker:
+    '''Validates emails, remembering the result for each email and, if
+    deliverability is checked, for each domain: a classlist needs at
+    most one DNS lookup per domain.'''
+
+    def __init__(self, check_deliverability):
+        self.check_deliverability = check_deliverability
+        self._emails = {}
+        self._domains = {}
+
+    def __call__(self, word):
+        valid = self._emails.get(word)
+        if valid is None:
+            valid = self._emails[word] = self._validate(word)
+        return valid
+
+    def _validate(self, word):
+        try:
+            domain = validate_email(word, check_deliverability=False
+                                    ).ascii_domain
+        except EmailNotValidError:
+            return False
+        if not self.check_deliverability:
+            return True
+
+        deliverable = self._domains.get(domain)
+        if deliverable is None:
+            deliverable = self._domains[domain] = _is_email(word)
+        return deliverable
+
+
+_EMAIL_CHECKERS = {'full': _EmailChecker(True),
+                   'syntax': _EmailChecker(False)}
+
+
+def _email_checker(check_emails):
+    if check_emails not in EMAIL_CHECKS:
+        raise ValueError('Invalid email check: {}. Use one of {}.'.format(
+            check_emails, EMAIL_CHECKS))
+    return _EMAIL_CHECKERS.get(check_emails)
+
+
 def _is_email(word):
     try:
         validate_email(word)
     except EmailNotValidError:
         return False
     return True
+
+
+def _checks(check_emails):
+    '''Return _CHECKS, with emails validated according to check_emails.'''
+
+    checks = dict(_CHECKS)
+    checks['email'] = _email_check(check_emails)
+    return checks
+
+
+# how to validate and normalize each (non-None) Student attribute
+_CHECKS = {'utorid': _check_utorid,
+           'student_number': _check_student_number,
+           'email': _email_check('full')}
+_CHECKS.update((attr, sys.intern) for attr in INTERNED_ATTRS)
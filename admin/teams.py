@@ -0,0 +1,92 @@
+"""Forming project teams (or breakout rooms) from Students, and assigning
+TAs to teams."""
+
+import heapq
+import random
+import sys
+
+from .students import SECTION_ATTRS
+
+
+def split_evenly(items, num_groups):
+    """Return a List of num_groups Lists that partition the Sequence
+    items, in order, with sizes that differ by at most one.
+
+    """
+
+    if num_groups < 1:
+        raise ValueError('Cannot split into {} groups.'.format(num_groups))
+    size, extra = divmod(len(items), num_groups)
+    groups = []
+    start = 0
+    for i in range(num_groups):
+        end = start + size + (i < extra)
+        groups.append(list(items[start:end]))
+        start = end
+    return groups
+
+
+def form_teams(students, max_size, by=SECTION_ATTRS, prefix='team',
+               seed=None):
+    """Put students (e.g., Students) into teams of at most max_size,
+    and set their team attribute. Only students that agree on all
+    attributes in by (by default, those of their section) are put in
+    the same team. Each section is split
+    into as few teams as possible, with sizes that differ by at most
+    one; students are shuffled first (with random seed seed).
+
+    Teams are named prefix followed by a zero-padded number. Return a
+    Dict[team, List[Student]], e.g., for gitutils.setup_team_repos.
+
+    """
+
+    if max_size < 1:
+        raise ValueError('Invalid team size: {}.'.format(max_size))
+
+    sections = {}
+    for student in students:
+        sections.setdefault(tuple(getattr(student, attr) or ''
+                                  for attr in by), []).append(student)
+
+    rng = random.Random(seed)
+    groups = []
+    for section in sorted(sections):
+        members = sections[section]
+        rng.shuffle(members)
+        groups.extend(split_evenly(members, -(-len(members) // max_size)))
+
+    width = len(str(len(groups)))
+    teams = {}
+    for number, members in enumerate(groups, 1):
+        team = sys.intern('{}{}'.format(prefix, str(number).zfill(width)))
+        for student in members:
+            student.team = team
+        teams[team] = members
+    return teams
+
+
+def assign_tas(teams, tas, loads=None):
+    """Assign a TA to each team, balancing the number of students each TA
+    marks: the largest teams go first, each to the TA with the least
+    load so far (longest processing time first).
+
+    teams is a Dict[team, List[Student]] (e.g., from form_teams).
+    tas is a non-empty Sequence of TAs (e.g., emails).
+    loads is a Dict[ta, int] of students the TAs already mark.
+    Return a Dict[team, ta], e.g., for utils.make_yaml_grading_sheet.
+
+    """
+
+    if not tas:
+        raise ValueError('Cannot assign teams to no TAs.')
+    loads = loads or {}
+    heap = [(loads.get(ta, 0), i, ta) for i, ta in enumerate(tas)]
+    heapq.heapify(heap)
+
+    team_to_ta = {}
+    for team in sorted(teams, key=lambda team: len(teams[team]),
+                       reverse=True):
+        load, i, ta = heap[0]
+        team_to_ta[team] = ta
+        heapq.heapreplace(heap, (load + len(teams[team]), i, ta))
+    return {team: team_to_ta[team] for team in teams}
@@ -4,6 +4,10 @@ Work in progress.
 
 """
 
+import json
+
+from .shared import _open_for_writing, _write_lines
+
 
 def make_team_to_students(students):
     '''Return a dict mapping team name to Student list.
@@ -36,6 +40,52 @@ def make_team_to_emails(students):
     return team_to_emails
 
 
+class TeamViews:
+    '''All views of Students by team, built in a single pass.
+
+    members: Dict[team, List[Student]]
+    emails: Dict[team, List[email]]
+    tas: Dict[team, ta_email] (empty if no team_to_ta_email given)
+    all_tas: List[ta_email] of all distinct TAs, in order of first
+      appearance in team_to_ta_email.
+    '''
+
+    def __init__(self, students, team_to_ta_email=None):
+        '''students is a Students object. Each Student must have team
+        attribute set. team_to_ta_email is a Dict[team_name: str,
+        ta_email: str].
+
+        '''
+
+        self.members = {}
+        self.emails = {}
+        for student in students:
+            assert student.team is not None
+            members = self.members.get(student.team)
+            if members is None:
+                members = self.members[student.team] = []
+                self.emails[student.team] = []
+            members.append(student)
+            self.emails[student.team].append(student.email)
+
+        self.tas = dict(team_to_ta_email or {})
+        self.all_tas = list(dict.fromkeys(self.tas.values()))
+
+    def audit(self, team):
+        '''Return a List of emails of all TAs but the one of team.'''
+
+        write = self.tas[team]
+        return [ta_email for ta_email in self.all_tas if ta_email != write]
+
+    def iter_grading_sheets(self):
+        '''Yield a dict for each team, as in make_yaml_grading_sheet.'''
+
+        for team, emails in self.emails.items():
+            assert None not in emails
+            yield {'sheet': team, 'write': [self.tas[team]],
+                   'audit': self.audit(team), 'read': emails}
+
+
 def make_yaml_grading_sheet(students, team_to_ta_email):
     '''Return a List[dict] that can be dumped to YAML for Thierry's
     grading rubric on grademywork.
@@ -45,15 +95,26 @@ def make_yaml_grading_sheet(students, team_to_ta_email):
 
     '''
 
-    team_to_emails = make_team_to_emails(students)
-
-    to_yaml = []
-    for team, emails in team_to_emails.items():
-        sheet = team
-        write = [team_to_ta_email[team]]
-        audit = [ta_email for ta_email in set(team_to_ta_email.values())
-                 if ta_email not in write]
-        read = emails
-        to_yaml.append({'sheet': sheet, 'write': write,
-                        'audit': audit, 'read': read})
-    return to_yaml
+    return list(TeamViews(students, team_to_ta_email).iter_grading_sheets())
+
+
+def write_yaml_grading_sheet(outfile, students, team_to_ta_email):
+    '''Write the grading sheets of make_yaml_grading_sheet to outfile (open
+    for writing, or a path) as YAML, one team at a time.
+
+    '''
+
+    views = TeamViews(students, team_to_ta_email)
+    with _open_for_writing(outfile) as out:
+        _write_lines(out, (_yaml_sheet(sheet)
+                           for sheet in views.iter_grading_sheets()))
+
+
+def _yaml_sheet(sheet):
+    '''Return sheet as a YAML list item. JSON strings and lists are valid
+    YAML flow scalars and sequences.'''
+
+    lines = ['- sheet: {}\n'.format(json.dumps(sheet['sheet']))]
+    lines.extend('  {}: {}\n'.format(field, json.dumps(sheet[field]))
+                 for field in ('write', 'audit', 'read'))
+    return ''.join(lines)
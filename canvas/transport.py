@@ -0,0 +1,159 @@
+"""An asyncio transport for the Quercus (Canvas) REST API, so that many
+requests (e.g., for several assignments) can wait on the network at
+once.
+
+Requests are made with a pooled requests.Session in a pool of threads,
+at most concurrency at a time. Quercus throttles clients with a bucket
+of request cost whose remainder it reports in X-Rate-Limit-Remaining:
+when it runs low, requests are spaced out (across all coroutines that
+share the transport), and throttled requests are retried with
+exponential backoff.
+
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# below this much X-Rate-Limit-Remaining, space out requests
+RATE_LIMIT_LOW = 200.0
+
+# delay between requests (in seconds) when the rate limit is low
+MIN_DELAY = 0.05
+MAX_DELAY = 5.0
+
+# how many times, and after how long (doubling each time), to retry a
+# throttled request
+MAX_RETRIES = 5
+BACKOFF = 1.0
+
+# seconds to wait for a connection or for a response, so that a stalled
+# connection cannot hang a sync
+TIMEOUT = 60.0
+
+
+class CanvasTransport:
+    """Makes Quercus API requests from asyncio code."""
+
+    def __init__(self, api_url, api_key, concurrency=8, per_page=100,
+                 timeout=TIMEOUT):
+        """api_url is the Quercus URL (e.g., https://q.utoronto.ca), and
+        api_key an access token. At most concurrency requests are made
+        at once, and paged listings ask for per_page items per page.
+        A request that gets no response in timeout seconds fails.
+
+        """
+
+        self.base_url = '{}/api/v1/'.format(api_url.rstrip('/'))
+        self.per_page = per_page
+        self.delay = 0.0
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers['Authorization'] = 'Bearer {}'.format(api_key)
+        adapter = HTTPAdapter(pool_maxsize=concurrency)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self._concurrency = concurrency
+        self._executor = ThreadPoolExecutor(concurrency)
+        self._semaphore = None  # made in the event loop that uses it
+        self._pace_lock = None  # likewise
+        self._next_send = 0.0  # event loop time of the next request
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Close all connections."""
+
+        self._executor.shutdown()
+        self.session.close()
+
+    async def request(self, method, path, **kwargs):
+        """Make a request and return the requests.Response. path is
+        relative to the API (e.g., 'courses/1/users'), or a full URL.
+        kwargs are passed on to requests (e.g., params, json). Raise
+        requests.HTTPError on an error response.
+
+        """
+
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._concurrency)
+            self._pace_lock = asyncio.Lock()
+        url = path if '://' in path else self.base_url + path
+        kwargs.setdefault('timeout', self.timeout)
+        send = partial(self.session.request, method, url, **kwargs)
+        loop = asyncio.get_running_loop()
+
+        for attempt in range(MAX_RETRIES + 1):
+            async with self._semaphore:
+                await self._pace(loop)
+                response = await loop.run_in_executor(self._executor, send)
+            self._adapt(response)
+            if not _is_throttled(response) or attempt == MAX_RETRIES:
+                break
+            await asyncio.sleep(BACKOFF * 2 ** attempt)
+
+        response.raise_for_status()
+        return response
+
+    async def get(self, path, **params):
+        """Return the JSON of a GET request with params."""
+
+        return (await self.request('GET', path, params=params)).json()
+
+    async def post(self, path, body):
+        """Return the JSON of a POST request with JSON body."""
+
+        return (await self.request('POST', path, json=body)).json()
+
+    async def get_all(self, path, **params):
+        """Return a List of all items of a paged listing, following the
+        next links of the responses.
+
+        """
+
+        params.setdefault('per_page', self.per_page)
+        response = await self.request('GET', path, params=params)
+        items = response.json()
+        while 'next' in response.links:
+            response = await self.request('GET', response.links['next']['url'])
+            items.extend(response.json())
+        return items
+
+    async def _pace(self, loop):
+        """Wait until at least delay seconds after the previous request
+        of any coroutine was sent."""
+
+        async with self._pace_lock:
+            wait = self._next_send - loop.time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            self._next_send = loop.time() + self.delay
+
+    def _adapt(self, response):
+        """Space out requests more if the rate limit is low or the request
+        was throttled, and less otherwise."""
+
+        remaining = response.headers.get('X-Rate-Limit-Remaining')
+        low = _is_throttled(response)
+        if remaining is not None:
+            try:
+                low = low or float(remaining) < RATE_LIMIT_LOW
+            except ValueError:
+                pass
+        if low:
+            self.delay = min(max(self.delay * 2, MIN_DELAY), MAX_DELAY)
+        else:
+            self.delay = self.delay / 2 if self.delay > MIN_DELAY else 0.0
+
+
+def _is_throttled(response):
+    return (response.status_code == 429 or
+            (response.status_code == 403 and
+             'Rate Limit Exceeded' in response.text))
@@ -1,16 +1,22 @@
 """Download/uplpoad to/from Quercus.
 """
 
+import asyncio
 from datetime import date
+from functools import partial
+import json
 import os
 import random
 import sys
+import time
 
 from canvasapi import Canvas
 
 sys.path.append('/home/anya/scripts')  # NOQA: E402
 import admin.gradebook as gb  # noqa
 import admin.students as sts  # noqa
+import admin.teams as tms  # noqa
+import canvas.transport as trans  # noqa
 
 API_URL = 'https://q.utoronto.ca'
 
@@ -31,6 +37,24 @@ KEY_MAP = {
     'utorid': 'sis_user_id'
 }
 
+# canvasapi.User attributes by which Quercus ids are looked up.
+ROSTER_FIELDS = ('login_id', 'integration_id', 'sis_user_id')
+
+# Where the roster index of a course (by course id) is saved between
+# runs, and for how many seconds it is used before it is downloaded
+# again. Set ROSTER_CACHE to None to download it once per run.
+ROSTER_CACHE = os.path.join(os.path.expanduser('~'), '.cache',
+                            'quercus_roster_{}.json')
+ROSTER_TTL = 60 * 60
+
+# Page size for paged listings: Quercus returns 10 items per page by
+# default, and allows up to 100.
+PER_PAGE = 100
+
+# How many Quercus requests to make at once when syncing several
+# assignments.
+CONCURRENCY = 8
+
 # Default format in which to write a classlist file. Here id1 is Quercus id.
 CLASSLIST_FORMAT = ('last', 'first', 'utorid', 'student_number',
                     'id1', 'email', 'lecture')
@@ -104,15 +128,61 @@ def download_asst_grades(course, asst_name, key='student_number'):
     """
 
     assignment = _get_assignment(course, asst_name)
-    submissions = assignment.get_submissions()
+    submissions = assignment.get_submissions(per_page=PER_PAGE)
+    roster = get_roster_index(course)
 
-    attr2grade = {getattr(course.get_user(submission.user_id), KEY_MAP[key]):
+    attr2grade = {roster.get_field(submission.user_id, KEY_MAP[key], course):
                   float(submission.score) if submission.score else 0.0
                   for submission in submissions}
 
     return attr2grade
 
 
+def download_assts_grades(course, asst_names, key='student_number',
+                          concurrency=CONCURRENCY):
+    """Return a Dict[asst_name, Dict[key, grade: float]], downloading
+    the grades of all asst_names at once.
+
+    course is a canvasapi.Course.
+    asst_names are the names of the assignments to download grades from.
+    key is the key in the inner dicts: 'utorid' or 'student_number'.
+    concurrency is how many requests to make at once.
+    """
+
+    return asyncio.run(_download_assts_grades(course, asst_names, key,
+                                              concurrency))
+
+
+async def _download_assts_grades(course, asst_names, key, concurrency):
+    course_id = course.id
+    async with _make_transport(course, concurrency) as transport:
+        roster, assignments = await asyncio.gather(
+            _get_roster_index_async(transport, course_id),
+            transport.get_all(f'courses/{course_id}/assignments'))
+        asst_ids = [_find_assignment_id(assignments, name)
+                    for name in asst_names]
+        all_submissions = await asyncio.gather(*(
+            transport.get_all(
+                f'courses/{course_id}/assignments/{asst_id}/submissions')
+            for asst_id in asst_ids))
+
+        # users not in the roster (e.g., the test student)
+        missing = {submission['user_id']
+                   for submissions in all_submissions
+                   for submission in submissions} - roster.users.keys()
+        users = await asyncio.gather(*(
+            transport.get(f'courses/{course_id}/users/{user_id}')
+            for user_id in missing))
+        for user in users:
+            roster.add_user(user['id'], user)
+
+    field = KEY_MAP[key]
+    return {name: {roster.get_field(submission['user_id'], field):
+                   float(submission['score']) if submission['score'] else 0.0
+                   for submission in submissions}
+            for name, submissions in zip(asst_names, all_submissions)}
+
+
 def upload_new_asst_grades(course, attribute_to_grade,
                            assignment_name='Assignment', out_of=None,
                            assignment_group_id=None):
@@ -126,15 +196,8 @@ def upload_new_asst_grades(course, attribute_to_grade,
 
     """
 
-    specs = {
-        'name': assignment_name,
-        'assignment_group_id': assignment_group_id,
-        'points_possible': out_of,
-        'hide_results': 'always',
-        'published': True  # can't bulk_apdate if not published!
-    }
-
-    assignment = course.create_assignment(specs)
+    assignment = course.create_assignment(
+        _assignment_specs(assignment_name, out_of, assignment_group_id))
 
     grade_data = {_get_user_id(course, attr): {'posted_grade': grade}
                   for (attr, grade) in attribute_to_grade.items()}
@@ -157,15 +220,8 @@ def upload_new_asst_grades_by_quercus_id(course, quercus_to_grade,
 
     """
 
-    specs = {
-        'name': assignment_name,
-        'assignment_group_id': assignment_group_id,
-        'points_possible': out_of,
-        'hide_results': 'always',
-        'published': True  # can't bulk_apdate if not published!
-    }
-
-    assignment = course.create_assignment(specs)
+    assignment = course.create_assignment(
+        _assignment_specs(assignment_name, out_of, assignment_group_id))
 
     grade_data = {quercus_id: {'posted_grade': grade}
                   for (quercus_id, grade) in quercus_to_grade.items()}
@@ -194,9 +250,64 @@ def upload_gradebook(course, gradebook, attr='student_number'):
 
     assert gradebook.outofs is not None
 
-    for asst_name, outof in gradebook.outofs.items():
-        attr_to_grade = gradebook.get_grades_dict(asst_name, attr)
-        upload_new_asst_grades(course, attr_to_grade, asst_name, outof)
+    columns = gradebook.get_grades_columns(key=attr)
+    asyncio.run(_upload_columns(course, columns, gradebook.outofs,
+                                CONCURRENCY))
+
+
+async def _upload_columns(course, columns, outofs, concurrency):
+    """Upload columns, a Dict[asst_name, Dict[attribute, grade]], as new
+    assignments with outofs, all at once. Raise KeyError, before
+    creating any assignment, if an attribute matches no Quercus user."""
+
+    course_id = course.id
+    async with _make_transport(course, concurrency) as transport:
+        roster = await _get_roster_index_async(transport, course_id)
+        missing = _missing_users(roster, columns)
+        if missing and roster.downloaded < _RUN_STARTED:
+            roster = await _get_roster_index_async(transport, course_id,
+                                                   refresh=True)
+            missing = _missing_users(roster, columns)
+        if missing:
+            raise KeyError('No Quercus users with: {}.'.format(
+                ', '.join(map(str, missing))))
+        await asyncio.gather(*(
+            _upload_new_asst_grades(transport, course_id, roster,
+                                    columns[asst_name], asst_name, outof)
+            for asst_name, outof in outofs.items()))
+
+
+def _missing_users(roster, columns):
+    return sorted({attr for column in columns.values() for attr in column
+                   if not roster.has(attr)}, key=str)
+
+
+async def _upload_new_asst_grades(transport, course_id, roster,
+                                  attribute_to_grade, assignment_name,
+                                  out_of=None, assignment_group_id=None):
+    assignment = await transport.post(
+        f'courses/{course_id}/assignments',
+        {'assignment': _assignment_specs(assignment_name, out_of,
+                                         assignment_group_id)})
+    grade_data = {roster.get_id(attr): {'posted_grade': grade}
+                  for (attr, grade) in attribute_to_grade.items()}
+    await transport.post(
+        f'courses/{course_id}/assignments/{assignment["id"]}'
+        '/submissions/update_grades',
+        {'grade_data': grade_data})
+
+
+def _assignment_specs(assignment_name, out_of=None, assignment_group_id=None):
+    specs = {
+        'name': assignment_name,
+        'assignment_group_id': assignment_group_id,
+        'points_possible': out_of,
+        'hide_results': 'always',
+        'published': True  # can't bulk_apdate if not published!
+    }
+    # canvasapi leaves out None values: do the same for JSON bodies, which
+    # would send them as null
+    return {key: value for key, value in specs.items() if value is not None}
 
 
 def write_classlist(course, path_prefix,
@@ -255,15 +366,27 @@ def write_breakout_rooms(course, num_students_per_room, path_prefix='.'):
     """
 
     sections = course.get_sections(include=['students'])
+    id_to_email = {user.id: getattr(user, 'email', None)
+                   for user in _get_students(course)}
 
     for section in sections:
         sec = section.name.split('-')[2]
         filename = os.path.join(
             path_prefix,
             f'{date.today().month}_{date.today().day}_{sec}.csv')
-        num_rooms = len(section.students) // num_students_per_room
-        emails = [course.get_user(student['id'], include=['email']).email
-                  for student in section.students]
+        num_rooms = max(len(section.students) // num_students_per_room, 1)
+        emails = []
+        for student in section.students:
+            email = id_to_email.get(student['id'])
+            if email is None:  # not listed, or email hidden: ask for it
+                email = getattr(course.get_user(student['id'],
+                                                include=['email']),
+                                'email', None)
+            if email is None:
+                print(f'WARNING: No email for {student["id"]}. '
+                      'Not assigned to a room.')
+            else:
+                emails.append(email)
         _write_breakout_rooms_one_section(emails, num_rooms, filename)
 
 
@@ -276,8 +399,8 @@ def _write_breakout_rooms_one_section(emails, num_rooms, filename):
     random.shuffle(emails)
     with open(filename, 'w', encoding='utf-8') as outfile:
         outfile.write('Pre-assign Room Name,Email Address\n')
-        for i, email in enumerate(emails):
-            outfile.write(f'room{i % num_rooms},{email}\n')
+        for room, members in enumerate(tms.split_evenly(emails, num_rooms)):
+            outfile.writelines(f'room{room},{email}\n' for email in members)
 
 
 def _get_user_by_utorid(course, utorid):
@@ -289,11 +412,188 @@ def _get_userid_by_utorid(course, utorid):
 
 
 def _get_user_id(course, attribute):
-    result = list(filter(
-        lambda user: attribute in (user.login_id, user.integration_id),
-        course.get_users()))
-    assert len(result) == 1
-    return result[0].id
+    return get_roster_index(course).get_id(attribute, course)
+
+
+class RosterIndex:
+    """Quercus ids of all users in a course, by each of ROSTER_FIELDS."""
+
+    def __init__(self, users, downloaded=None):
+        """users is a Dict[Quercus id: int, Dict[field, value]] with all
+        ROSTER_FIELDS of each user. downloaded is when (time.time()) the
+        users were downloaded from Quercus.
+
+        """
+
+        self._reindex(users, downloaded)
+
+    def _reindex(self, users, downloaded=None):
+        self.users = users
+        self.downloaded = time.time() if downloaded is None else downloaded
+        self._ids = {field: {} for field in ROSTER_FIELDS}
+        for user_id, fields in users.items():
+            for field, index in self._ids.items():
+                if fields.get(field) is not None:
+                    index[fields[field]] = user_id
+
+    @staticmethod
+    def download(course):
+        """Return a new RosterIndex of all users in course (one paged
+        listing of users).
+
+        """
+
+        return RosterIndex({
+            user.id: {field: getattr(user, field, None)
+                      for field in ROSTER_FIELDS}
+            for user in course.get_users(per_page=PER_PAGE)})
+
+    def get_id(self, attribute, course=None):
+        """Return the Quercus id of the user with any of ROSTER_FIELDS equal
+        to attribute (e.g., a utorid or student number). If there is no
+        such user, and course is given and this RosterIndex was saved in
+        an earlier run, download the roster of course again (it may have
+        changed) and retry. Raise KeyError if there is no such user.
+
+        """
+
+        for index in self._ids.values():
+            if attribute in index:
+                return index[attribute]
+        if course is not None and self.downloaded < _RUN_STARTED:
+            self.refresh(course)
+            return self.get_id(attribute)
+        raise KeyError('No Quercus user with {}.'.format(attribute))
+
+    def has(self, attribute):
+        """Return whether a user has any of ROSTER_FIELDS equal to
+        attribute."""
+
+        return any(attribute in index for index in self._ids.values())
+
+    def add_user(self, user_id, user):
+        """Add the user with Quercus id user_id. user is a canvasapi.User or
+        a Dict from the Quercus API."""
+
+        get = user.get if isinstance(user, dict) else partial(getattr, user)
+        self.users[user_id] = fields = {field: get(field, None)
+                                        for field in ROSTER_FIELDS}
+        for field, index in self._ids.items():
+            if fields[field] is not None:
+                index[fields[field]] = user_id
+
+    def get_field(self, user_id, field, course=None):
+        """Return field (one of ROSTER_FIELDS) of the user with Quercus id
+        user_id. If there is no such user (e.g., the test student) and
+        course is given, get the user from course and remember it.
+        Raise KeyError if there is no such user.
+
+        """
+
+        if user_id not in self.users and course is not None:
+            self.add_user(user_id, course.get_user(user_id))
+        return self.users[user_id][field]
+
+    def refresh(self, course):
+        """Download the roster of course again, and save it if
+        ROSTER_CACHE is set.
+
+        """
+
+        self._reindex(RosterIndex.download(course).users)
+        if ROSTER_CACHE is not None:
+            self.save(ROSTER_CACHE.format(course.id))
+
+    async def refresh_async(self, transport, course_id):
+        """Like refresh, with a CanvasTransport."""
+
+        users = await transport.get_all(f'courses/{course_id}/users')
+        self._reindex({})
+        for user in users:
+            self.add_user(user['id'], user)
+        if ROSTER_CACHE is not None:
+            self.save(ROSTER_CACHE.format(course_id))
+
+    def save(self, path):
+        """Save this RosterIndex to a JSON file path, readable only by its
+        owner: it has every student's utorid and student number."""
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        descriptor = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                             0o600)
+        os.chmod(path, 0o600)  # in case it existed with a wider mode
+        with open(descriptor, 'w', encoding='utf-8') as outfile:
+            json.dump({'downloaded': self.downloaded,
+                       'users': list(self.users.items())}, outfile)
+
+    @staticmethod
+    def load(path, ttl=None):
+        """Return a RosterIndex saved in path, or None if there is none or
+        it is older than ttl (default ROSTER_TTL) seconds.
+
+        """
+
+        ttl = ROSTER_TTL if ttl is None else ttl
+        try:
+            with open(path, encoding='utf-8') as infile:
+                saved = json.load(infile)
+        except (OSError, ValueError):
+            return None
+        if time.time() - saved['downloaded'] > ttl:
+            return None
+        return RosterIndex(dict((user_id, fields)
+                                for user_id, fields in saved['users']),
+                           saved['downloaded'])
+
+
+# RosterIndexes already used in this run, by course id
+_roster_indexes = {}
+_RUN_STARTED = time.time()
+
+
+def get_roster_index(course, ttl=None):
+    """Return the RosterIndex of course: the one already used in this
+    run, or the one saved in ROSTER_CACHE if not older than ttl
+    (default ROSTER_TTL) seconds, or else a newly downloaded (and
+    saved) one.
+
+    """
+
+    index = _roster_indexes.get(course.id)
+    if index is None and ROSTER_CACHE is not None:
+        index = RosterIndex.load(ROSTER_CACHE.format(course.id), ttl)
+    if index is None:
+        index = RosterIndex({}, 0)
+        index.refresh(course)
+    _roster_indexes[course.id] = index
+    return index
+
+
+async def _get_roster_index_async(transport, course_id, ttl=None,
+                                  refresh=False):
+    """Like get_roster_index, with a CanvasTransport. If refresh, always
+    download the roster."""
+
+    index = None if refresh else _roster_indexes.get(course_id)
+    if index is None and ROSTER_CACHE is not None and not refresh:
+        index = RosterIndex.load(ROSTER_CACHE.format(course_id), ttl)
+    if index is None:
+        index = RosterIndex({}, 0)
+        await index.refresh_async(transport, course_id)
+    _roster_indexes[course_id] = index
+    return index
+
+
+def _make_transport(course, concurrency=CONCURRENCY):
+    """Return a CanvasTransport with the URL and access token of the
+    canvasapi.Canvas that course came from."""
+
+    requester = course._requester  # pylint: disable=protected-access
+    api_url = getattr(requester, 'original_url', None)
+    if api_url is None:
+        api_url = requester.base_url.rstrip('/')[:-len('/api/v1')]
+    return trans.CanvasTransport(api_url, requester.access_token,
+                                 concurrency, PER_PAGE)
 
 
 def _get_tas(course):
@@ -306,7 +606,18 @@ def _get_students(course):
 
 def _get_role(course, role):
     return list(course.get_users(enrollment_type=[role],
-                                 include=['email', 'enrollments']))
+                                 include=['email', 'enrollments'],
+                                 per_page=PER_PAGE))
+
+
+def _find_assignment_id(assignments, name):
+    """Return the id of the assignment with name in assignments, a List of
+    Dicts from the Quercus API."""
+
+    result = [assignment['id'] for assignment in assignments
+              if assignment['name'] == name]
+    assert len(result) == 1
+    return result[0]
 
 
 def _get_assignment(course, name):
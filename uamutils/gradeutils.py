@@ -144,8 +144,10 @@ def template_all(marking_dir, result_files, txt=True, gf=True,
     os.chdir(marking_dir)
 
 
-def gen_all(result_files, result_file_to_weigths):
+def gen_all(result_files, result_file_to_weigths, external_gen=True):
     """result_file_to_weigths maps result-file-name.gf to weights-file-name.gf
+    If external_gen, run gen to calculate formulas; otherwise,
+    recompute them with GradeBook.recompute (see recompute_all).
     """
 
     print('Fixing up gf\'s.')
@@ -164,12 +166,60 @@ def gen_all(result_files, result_file_to_weigths):
         with open(f'{result_file}.gf', 'w', encoding='utf-8') as newfile:
             newfile.write(''.join(content))
 
+    if not external_gen:
+        recompute_all(result_files)
+        return
+
     for result_file in result_files:
         print(f'Running gen on {result_file}.gf...')
         exit_code = subprocess.call(['gen', f'{result_file}.gf'])
         print(f'Done. Exit code {exit_code}')
 
 
+def recompute_all(result_files, changed=None):
+    """Recompute calculated columns in result-file-name.gf, for each of
+    result_files, without running gen.
+
+    changed is an iterable of names of columns that changed; only the
+    calculated columns that depend on them are recomputed. If None,
+    recompute all.
+    """
+
+    for result_file in result_files:
+        print(f'Recomputing formulas in {result_file}.gf...')
+        path = f'{result_file}.gf'
+        with open(path, encoding='utf-8') as infile:
+            assts, _, _ = gb.read_gf_header(infile)
+            num_students = sum(
+                1 for line in infile
+                if gb.GF_STUDENT_LINE.fullmatch(line.split(',')[0].strip()))
+            infile.seek(0)
+            utorid = _has_utorid_column(infile, assts)
+            infile.seek(0)
+            gbook = gb.GradeBook.load_gf_file(infile, 'student_number',
+                                              utorid)
+        if len(gbook) != num_students:
+            print(f'WARNING: {path} has {num_students} student lines but '
+                  f'only {len(gbook)} distinct students. Not rewriting it.')
+            continue
+        recomputed = gbook.recompute(changed)
+        with open(f'{path}.tmp', 'w', encoding='utf-8') as outfile:
+            gbook.write_gf(outfile, assts, utorid)
+        os.replace(f'{path}.tmp', path)
+        print(f'Done. Recomputed {", ".join(recomputed) or "nothing"}.')
+
+
+def _has_utorid_column(infile, assts):
+    """Return whether the header of gf file infile has a utorid line."""
+
+    for line in infile:
+        if not line.strip():
+            return False
+        if line.split()[0] == 'utorid' and 'utorid' not in assts:
+            return True
+    return False
+
+
 def run_one(utorid, marking_dir, config):
     """Run tester on one submission."""
 